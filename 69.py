@@ -3,7 +3,7 @@ import requests
 import json
 import telebot
 import time
-from msal import PublicClientApplication
+from msal import PublicClientApplication, SerializableTokenCache
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from datetime import datetime, timedelta
 import pyshorteners
@@ -15,6 +15,27 @@ from telegraph import Telegraph
 from datetime import timedelta
 from telebot.types import Message
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton
+import re
+import random
+import asyncio
+import sqlite3
+import threading
+import bisect
+import hashlib
+import unicodedata
+from collections import deque
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+try:
+    import aiohttp
+except ImportError:  # Optional: without it bulk links use the synchronous batch pipeline
+    aiohttp = None
+try:
+    import fcntl
+except ImportError:  # Not on Windows: the token store then only locks between threads
+    fcntl = None
+from contextlib import contextmanager
+from urllib.parse import quote
 # ----------------------------#
 #       Configuration         #
 # ----------------------------#
@@ -36,7 +57,63 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 GRAPH_CLIENT_ID = os.getenv('GRAPH_CLIENT_ID')
 GRAPH_TENANT_ID = os.getenv('GRAPH_TENANT_ID')
-TOKEN_FILE = "user_token.txt"  # File to store the access token
+TOKEN_FILE = "user_token.txt"  # Legacy token file; imported into the MSAL token cache once
+TOKEN_CACHE_FILE = os.getenv('TOKEN_CACHE_FILE', 'token_cache.json')  # Persisted MSAL token cache
+GRAPH_SCOPES = ["Files.ReadWrite.All"]
+TOKEN_REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN', '300'))  # Seconds before expiry to renew the token
+TOKEN_RETRY_INTERVAL = 30  # Seconds between attempts when a background refresh fails
+
+# Microsoft Graph HTTP settings
+GRAPH_API_URL = os.getenv('GRAPH_API_URL', 'https://graph.microsoft.com/v1.0')
+GRAPH_POOL_SIZE = int(os.getenv('GRAPH_POOL_SIZE', '20'))  # Keep-alive connections per host
+GRAPH_TIMEOUT = float(os.getenv('GRAPH_TIMEOUT', '30'))  # Seconds per Graph call
+GRAPH_PAGE_SIZE = int(os.getenv('GRAPH_PAGE_SIZE', '200'))  # $top for folder listings
+LISTING_FIELDS = "id,name,folder"  # The only driveItem fields the file browser renders
+SORT_ORDERS = {  # File browser sort modes -> Graph $orderby
+    'name': 'name',
+    'date': 'lastModifiedDateTime desc',
+    'size': 'size desc'
+}
+SORT_MODES = tuple(SORT_ORDERS)  # Callback data carries the index of the mode
+SNAPSHOT_TTL = int(os.getenv('SNAPSHOT_TTL', '900'))  # Seconds a browsing session keeps its listing snapshot
+GRAPH_BATCH_SIZE = 20  # Graph's limit of sub-requests per $batch call
+GRAPH_BATCH_RETRIES = int(os.getenv('GRAPH_BATCH_RETRIES', '3'))  # Retries for throttled/failed sub-requests
+GRAPH_MAX_RETRIES = int(os.getenv('GRAPH_MAX_RETRIES', '5'))  # Retries for throttled/failed Graph calls
+GRAPH_BACKOFF_BASE = 0.5  # Seconds; doubled on every retry, with full jitter
+GRAPH_BACKOFF_MAX = 30  # Upper bound for a single backoff sleep
+GRAPH_MAX_CONCURRENCY = int(os.getenv('GRAPH_MAX_CONCURRENCY', '8'))  # Ceiling for concurrent Graph requests
+GRAPH_RETRY_STATUSES = (429, 500, 502, 503, 504)
+ASYNC_LINK_CONCURRENCY = int(os.getenv('ASYNC_LINK_CONCURRENCY', '16'))  # Concurrent calls in the async link pipeline
+SUBTREE_MAX_DEPTH = int(os.getenv('SUBTREE_MAX_DEPTH', '4'))  # Folder levels below the starting folder
+SUBTREE_MAX_FOLDERS = int(os.getenv('SUBTREE_MAX_FOLDERS', '300'))  # Folders listed per recursive harvest
+SUBTREE_MAX_FILES = int(os.getenv('SUBTREE_MAX_FILES', '2000'))  # Links generated per recursive harvest
+SUBTREE_WORKERS = 4  # Concurrent folder listings (and link batches) in a recursive harvest
+FOLDER_CACHE_TTL = int(os.getenv('FOLDER_CACHE_TTL', '60'))  # Seconds a cached listing is served without revalidation
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'false').lower() == 'true'  # Warm listings of visible subfolders
+PREFETCH_MAX_FOLDERS = int(os.getenv('PREFETCH_MAX_FOLDERS', '5'))  # Subfolders prefetched per rendered page
+PREFETCH_WORKERS = 2  # Background threads; kept small so prefetching never crowds out user requests
+
+# Local mirror of the browsable subtree, kept current with the /delta API
+HOME_FOLDER_PATH = "69/USER MARIO"
+DRIVE_MIRROR_ENABLED = os.getenv('DRIVE_MIRROR_ENABLED', 'false').lower() == 'true'
+DELTA_POLL_INTERVAL = int(os.getenv('DELTA_POLL_INTERVAL', '30'))  # Seconds between delta polls
+SEARCH_MAX_RESULTS = 20  # Buttons returned by /search
+
+LINK_DB_FILE = os.getenv('LINK_DB_FILE', 'links.db')  # SQLite store of generated share links
+LINK_FIELDS = "id,name,folder,eTag"  # Listing fields needed to validate stored links
+SHORTENER_BASE_URL = os.getenv('SHORTENER_BASE_URL')  # Public URL of app.py; enables its /s/<code> short links
+SHORT_CODE_LENGTH = 7  # base62 characters per short code (62^7 ~ 3.5e12 codes)
+SHORTENER_PROVIDERS = [name.strip() for name in os.getenv('SHORTENER_PROVIDERS', 'tinyurl,isgd').split(',') if name.strip()]
+SHORTENER_TIMEOUT = float(os.getenv('SHORTENER_TIMEOUT', '3'))  # Hard limit for shortening one URL
+SHORTENER_HEDGE_AFTER = float(os.getenv('SHORTENER_HEDGE_AFTER', '0.8'))  # Seconds before a slow call is raced on the next provider
+SHORTENER_WORKERS = 16  # Concurrent shortening calls
+
+# Alternative service endpoints, e.g. the local stand-ins from standins.py
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # Default: https://api.telegram.org
+TINYURL_API_URL = os.getenv('TINYURL_API_URL')  # Default: http://tinyurl.com/api-create.php
+ISGD_API_URL = os.getenv('ISGD_API_URL')  # Default: https://is.gd/create.php
+TELEGRAPH_API_URL = os.getenv('TELEGRAPH_API_URL')  # Default: https://api.telegra.ph
+GRAPH_LOGIN_URL = os.getenv('GRAPH_LOGIN_URL')  # Default: https://login.microsoftonline.com
 
 # Validate environment variables
 if not TELEGRAM_BOT_TOKEN:
@@ -52,8 +129,36 @@ if not GRAPH_TENANT_ID:
 # Authorized users for sensitive commands
 AUTHORIZED_USERS = [1585904762, 987654321]  # Replace with actual Telegram user IDs
 
+# Outbound Telegram flood limits (see TelegramDispatcher)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))  # Messages per second across all chats
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))  # Messages per second to one private chat
+TELEGRAM_CHAT_BURST = 2  # Back-to-back messages to one private chat (Telegram allows ~3; one is kept as slack for network jitter)
+TELEGRAM_GROUP_RATE = 20 / 60  # Messages per second to one group
+TELEGRAM_MAX_RETRIES = 3  # Retries of a call answered with 429
+PRIORITY_INTERACTIVE = 0  # Replies to a user's command or tap
+PRIORITY_BULK = 1  # Link lists from "Generate All Links"
+PRIORITY_BROADCAST = 2  # /broadcast
+
+class BaseURLAdapter(HTTPAdapter):
+    """
+    Rewrites requests for one base URL to another. Used to point clients without
+    a base URL option (Telegraph) at alternative endpoints.
+    """
+
+    def __init__(self, source, target, **kwargs):
+        super().__init__(**kwargs)
+        self.source = source
+        self.target = target.rstrip('/') + '/'
+
+    def send(self, request, **kwargs):
+        if request.url.startswith(self.source):
+            request.url = self.target + request.url[len(self.source):]
+        return super().send(request, **kwargs)
+
 # Initialize Telegraph
 telegraph = Telegraph()
+if TELEGRAPH_API_URL:
+    telegraph._telegraph.session.mount('https://api.telegra.ph/', BaseURLAdapter('https://api.telegra.ph/', TELEGRAPH_API_URL))
 telegraph.create_account(short_name='MyBot')  # Replace 'MyBot' with your preferred short name
 start_time = time.time()
 
@@ -62,17 +167,613 @@ start_time = time.time()
 # ----------------------------#
 
 # Set up Telegram bot
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + "/bot{0}/{1}"
 bot = telebot.TeleBot(TELEGRAM_BOT_TOKEN)
 
-# MSAL public client for device code flow
+# MSAL public client for device code flow; tokens live in MSAL's own cache
+token_cache = SerializableTokenCache()
+msal_http_client = None
+if GRAPH_LOGIN_URL:
+    # MSAL only accepts https authorities, so send its traffic elsewhere at the session level
+    msal_http_client = requests.Session()
+    msal_http_client.mount('https://login.microsoftonline.com/',
+                           BaseURLAdapter('https://login.microsoftonline.com/', GRAPH_LOGIN_URL))
 msal_app = PublicClientApplication(
     GRAPH_CLIENT_ID,
-    authority=f"https://login.microsoftonline.com/{GRAPH_TENANT_ID}"
+    authority=f"https://login.microsoftonline.com/{GRAPH_TENANT_ID}",
+    http_client=msal_http_client,
+    token_cache=token_cache
 )
 
 # In-memory user sessions
 user_sessions = {}
 
+# ----------------------------#
+#        Graph Client         #
+# ----------------------------#
+
+def retry_after_seconds(headers):
+    """
+    Parses a Retry-After header given in seconds. Returns 0 if absent or unparseable.
+    """
+    try:
+        return max(0, int(float(headers.get('Retry-After', 0))))
+    except (TypeError, ValueError):
+        return 0
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter for the given (0-based) retry attempt.
+    """
+    return random.uniform(0, min(GRAPH_BACKOFF_MAX, GRAPH_BACKOFF_BASE * (2 ** attempt)))
+
+def build_batch_payload(chunk, sub_requests):
+    """
+    Builds a JSON $batch body for the sub-requests at the given indexes (used as batch ids).
+    """
+    payload = {'requests': []}
+    for index in chunk:
+        sub_request = sub_requests[index]
+        entry = {'id': str(index), 'method': sub_request['method'], 'url': '/' + sub_request['url'].lstrip('/')}
+        if 'body' in sub_request:
+            entry['body'] = sub_request['body']
+            entry['headers'] = {'Content-Type': 'application/json'}
+        payload['requests'].append(entry)
+    return payload
+
+def collect_batch_responses(chunks, outcomes, results, limiter):
+    """
+    Stores sub-responses of sent batches into `results` by index.
+
+    `outcomes` holds (responses, retry_after) per chunk, with responses None when
+    the whole batch failed. Returns the indexes to retry and the largest Retry-After.
+    """
+    retry, retry_after = [], 0
+    for chunk, (responses, chunk_retry_after) in zip(chunks, outcomes):
+        retry_after = max(retry_after, chunk_retry_after)
+        if responses is None:
+            retry.extend(chunk)
+            continue
+        for sub_response in responses:
+            index = int(sub_response['id'])
+            status = sub_response.get('status')
+            results[index] = (status, sub_response.get('body'))
+            if status in GRAPH_RETRY_STATUSES:
+                retry.append(index)
+                sub_retry_after = retry_after_seconds(sub_response.get('headers', {}))
+                retry_after = max(retry_after, sub_retry_after)
+                if status in (429, 503):
+                    limiter.record_throttle(sub_retry_after)
+    return retry, retry_after
+
+class AdaptiveLimiter:
+    """
+    Adaptive (AIMD) cap on concurrent Graph requests.
+
+    The limit grows by one after a full window of unthrottled responses and is
+    halved when Graph throttles (429/503), at most once per second. A Retry-After
+    pauses every caller until it has passed, not just the one that was throttled.
+    Threads take a slot with acquire(), coroutines with acquire_async(); both
+    draw on the same limit.
+    """
+
+    def __init__(self, initial=GRAPH_MAX_CONCURRENCY // 2 or 1, maximum=GRAPH_MAX_CONCURRENCY, minimum=1):
+        self.limit = initial
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self.paused_until = 0
+        self._successes = 0
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+        self._async_waiters = []  # (loop, asyncio.Event) of coroutines waiting for a slot
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self.in_flight >= self.limit:
+                    self._cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        """
+        acquire() for coroutines: waits for a slot without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                pause = self.paused_until - time.monotonic()
+                if pause <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                waiter = (loop, asyncio.Event())
+                self._async_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1].wait(), pause if pause > 0 else None)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._cond:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def _notify(self):
+        # Called with _cond held: wakes waiting threads and coroutines
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+        self._async_waiters.clear()
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._notify()
+
+    def record_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._notify()
+
+    def record_throttle(self, retry_after=0):
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease >= 1:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._last_decrease = now
+                logging.warning(f"Graph throttled, concurrency limit lowered to {self.limit}.")
+            self._successes = 0
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+class GraphClient:
+    """
+    Shared Microsoft Graph HTTP client.
+
+    All Graph calls go through one pooled keep-alive session, so consecutive
+    requests reuse an open TLS connection instead of handshaking every time.
+    Every call is timed and kept in a short history for /graphstats.
+
+    Throttled (429/503) and failed (5xx, connection error) calls are retried with
+    Retry-After or jittered exponential backoff, and an AdaptiveLimiter keeps the
+    number of concurrent requests at what the tenant currently accepts.
+    """
+
+    def __init__(self, base_url=GRAPH_API_URL, pool_size=GRAPH_POOL_SIZE, timeout=GRAPH_TIMEOUT, history=500):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+        self.timings = deque(maxlen=history)
+        self.limiter = AdaptiveLimiter()
+        self._executor = ThreadPoolExecutor(max_workers=GRAPH_MAX_CONCURRENCY, thread_name_prefix="graph")
+        self._lock = threading.Lock()
+
+    def url(self, path):
+        """
+        Builds an absolute Graph URL. Absolute URLs (e.g. @odata.nextLink) are used as-is.
+        """
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, access_token, **kwargs):
+        """
+        Sends a Graph request on the pooled session, retrying throttled or failed
+        calls, and records the latency of every attempt.
+        """
+        headers = kwargs.pop('headers', None) or {}
+        headers['Authorization'] = f'Bearer {access_token}'
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(GRAPH_MAX_RETRIES + 1):
+            self.limiter.acquire()
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, self.url(path), headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == GRAPH_MAX_RETRIES:
+                    raise
+                logging.warning(f"Graph {method} {path} failed ({e}), retrying.")
+                time.sleep(backoff_delay(attempt))
+                continue
+            finally:
+                self.limiter.release()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            self._record(method, path, response.status_code, elapsed_ms)
+            logging.debug(f"Graph {method} {path} -> {response.status_code} in {elapsed_ms:.1f} ms")
+
+            retry_after = retry_after_seconds(response.headers)
+            if response.status_code in (429, 503):
+                self.limiter.record_throttle(retry_after)
+            else:
+                self.limiter.record_success()
+
+            if response.status_code not in GRAPH_RETRY_STATUSES or attempt == GRAPH_MAX_RETRIES:
+                return response
+
+            delay = retry_after or backoff_delay(attempt)
+            logging.warning(f"Graph {method} {path} returned {response.status_code}, retrying in {delay:.1f}s.")
+            time.sleep(delay)
+
+    def get(self, path, access_token, **kwargs):
+        return self.request('GET', path, access_token, **kwargs)
+
+    def post(self, path, access_token, **kwargs):
+        return self.request('POST', path, access_token, **kwargs)
+
+    def batch(self, sub_requests, access_token):
+        """
+        Runs Graph sub-requests through JSON $batch, GRAPH_BATCH_SIZE per round trip.
+
+        Each sub-request is a dict with 'method', 'url' (relative to the API root)
+        and an optional JSON 'body'. Returns one (status, body) tuple per sub-request
+        in the same order. The batches are sent concurrently under the limiter.
+        Sub-requests that were throttled or failed with a 5xx are retried in later
+        batches, honouring the largest Retry-After seen.
+        """
+        results = [(None, None)] * len(sub_requests)
+        pending = list(range(len(sub_requests)))
+        attempt = 0
+
+        while pending:
+            chunks = [pending[start:start + GRAPH_BATCH_SIZE] for start in range(0, len(pending), GRAPH_BATCH_SIZE)]
+            # Chunks are sent concurrently; the limiter decides how many are actually in flight
+            futures = [self._executor.submit(self._send_batch, chunk, sub_requests, access_token) for chunk in chunks]
+            outcomes = [future.result() for future in futures]
+            retry, retry_after = collect_batch_responses(chunks, outcomes, results, self.limiter)
+
+            if not retry or attempt >= GRAPH_BATCH_RETRIES:
+                break
+            pending = sorted(retry)
+            logging.warning(f"Retrying {len(pending)} Graph batch sub-requests (attempt {attempt + 1}).")
+            time.sleep(retry_after or backoff_delay(attempt))
+            attempt += 1
+
+        return results
+
+    def _send_batch(self, chunk, sub_requests, access_token):
+        payload = build_batch_payload(chunk, sub_requests)
+        try:
+            response = self.post('$batch', access_token, json=payload)
+        except Exception as e:
+            logging.error(f"Exception in Graph batch: {e}")
+            return None, 0
+        if response.status_code != 200:
+            logging.error(f"Error in Graph batch: {response.status_code} - {response.text}")
+            return None, retry_after_seconds(response.headers)
+        return response.json().get('responses', []), 0
+
+    def _record(self, method, path, status_code, elapsed_ms):
+        # Collapse item ids and query strings so timings group by endpoint
+        endpoint = path.split('?')[0].replace(self.base_url, '').lstrip('/')
+        endpoint = re.sub(r'items/[^/]+', 'items/{id}', endpoint)
+        with self._lock:
+            self.timings.append((method, endpoint, status_code, elapsed_ms))
+
+    def stats(self):
+        """
+        Returns per-endpoint call count and average/max latency (ms) of recent calls.
+        """
+        with self._lock:
+            timings = list(self.timings)
+
+        summary = {}
+        for method, endpoint, _, elapsed_ms in timings:
+            entry = summary.setdefault(f"{method} {endpoint}", {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            entry['calls'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        for entry in summary.values():
+            entry['avg_ms'] = entry['total_ms'] / entry['calls']
+        return summary
+
+# Single Graph client shared by every Graph call
+graph = GraphClient()
+
+class AsyncGraphClient:
+    """
+    asyncio counterpart of GraphClient, used by the bulk link pipeline.
+
+    Owns an event loop on a background thread and one pooled aiohttp session,
+    so a handler thread can hand a whole pipeline off with submit() and return
+    immediately. Retries and Retry-After handling match GraphClient. Every
+    request takes a slot from graph.limiter, the same AdaptiveLimiter the sync
+    client uses, so bulk work counts against the one concurrency limit and both
+    clients back off together when Graph throttles.
+    """
+
+    def __init__(self, base_url=GRAPH_API_URL, pool_size=GRAPH_POOL_SIZE, timeout=GRAPH_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.loop = None
+        self._session = None
+        self._batch_slots = asyncio.Semaphore(ASYNC_LINK_CONCURRENCY)  # $batch POSTs queued at once, across all pipelines
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="graph-async", daemon=True).start()
+        return self.loop
+
+    def submit(self, coro):
+        """
+        Schedules a coroutine on the client's loop and returns a concurrent.futures.Future.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'}
+            )
+        return self._session
+
+    def url(self, path):
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def request(self, method, path, access_token, params=None, json_body=None):
+        """
+        Sends a Graph request and returns (status, JSON body or None, headers).
+        """
+        headers = {'Authorization': f'Bearer {access_token}'}
+        session = self._get_session()
+
+        for attempt in range(GRAPH_MAX_RETRIES + 1):
+            await graph.limiter.acquire_async()
+            started = time.perf_counter()
+            try:
+                async with session.request(method, self.url(path), params=params, json=json_body, headers=headers) as response:
+                    status = response.status
+                    response_headers = response.headers
+                    text = await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == GRAPH_MAX_RETRIES:
+                    raise
+                logging.warning(f"Async Graph {method} {path} failed ({e!r}), retrying.")
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            finally:
+                graph.limiter.release()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            graph._record(method, path, status, elapsed_ms)
+
+            retry_after = retry_after_seconds(response_headers)
+            if status in (429, 503):
+                graph.limiter.record_throttle(retry_after)
+            else:
+                graph.limiter.record_success()
+
+            if status not in GRAPH_RETRY_STATUSES or attempt == GRAPH_MAX_RETRIES:
+                try:
+                    body = json.loads(text) if text else None
+                except ValueError:
+                    body = None
+                return status, body, response_headers
+
+            await asyncio.sleep(retry_after or backoff_delay(attempt))
+
+    async def get(self, path, access_token, params=None):
+        return await self.request('GET', path, access_token, params=params)
+
+    async def post(self, path, access_token, json_body=None):
+        return await self.request('POST', path, access_token, json_body=json_body)
+
+    async def batch(self, sub_requests, access_token):
+        """
+        Async GraphClient.batch: $batch chunks are sent concurrently, with the
+        same retry rules. At most ASYNC_LINK_CONCURRENCY chunks are queued at once
+        across every pipeline; graph.limiter decides how many are in flight.
+        """
+        results = [(None, None)] * len(sub_requests)
+        pending = list(range(len(sub_requests)))
+        attempt = 0
+
+        async def send(chunk):
+            async with self._batch_slots:
+                try:
+                    status, body, headers = await self.post('$batch', access_token, build_batch_payload(chunk, sub_requests))
+                except Exception as e:
+                    logging.error(f"Exception in async Graph batch: {e!r}")
+                    return None, 0
+            if status != 200:
+                logging.error(f"Error in async Graph batch: {status} - {body}")
+                return None, retry_after_seconds(headers)
+            return body.get('responses', []), 0
+
+        while pending:
+            chunks = [pending[start:start + GRAPH_BATCH_SIZE] for start in range(0, len(pending), GRAPH_BATCH_SIZE)]
+            outcomes = await asyncio.gather(*(send(chunk) for chunk in chunks))
+            retry, retry_after = collect_batch_responses(chunks, outcomes, results, graph.limiter)
+
+            if not retry or attempt >= GRAPH_BATCH_RETRIES:
+                break
+            pending = sorted(retry)
+            logging.warning(f"Retrying {len(pending)} async Graph batch sub-requests (attempt {attempt + 1}).")
+            await asyncio.sleep(retry_after or backoff_delay(attempt))
+            attempt += 1
+
+        return results
+
+async_graph = AsyncGraphClient() if aiohttp else None
+
+class TokenBucket:
+    """
+    `rate` tokens per second, holding at most `capacity`. Not thread-safe on its own.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def wait_time(self, now):
+        """
+        Seconds until a token is available (0 if one is available now).
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class TelegramDispatcher:
+    """
+    Outbound gate for every Telegram Bot API call, installed as telebot's request sender.
+
+    Calls addressed to a chat (sending, editing, copying, documents) first take
+    a token from a global bucket (TELEGRAM_GLOBAL_RATE) and one from that chat's
+    bucket (TELEGRAM_CHAT_RATE, or TELEGRAM_GROUP_RATE for groups), keeping the
+    bot under Telegram's flood limits. Waiting calls are admitted by priority
+    class (interactive, then bulk, then broadcast) and in arrival order within a
+    class; a call is never held up by one for another chat that has to wait
+    anyway. A 429 pauses the chat for its retry_after before the call is retried.
+    Calls without a chat (getUpdates, answerCallbackQuery) go straight through.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, max_retries=TELEGRAM_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=32)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.global_bucket = TokenBucket(global_rate, max(1, global_rate - 1))  # One below the limit, as slack for jitter
+        self.chat_buckets = {}
+        self.waiting = []  # (priority, arrival, chat_id) of calls waiting for tokens
+        self.sent = 0
+        self.throttled = 0
+        self._arrivals = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    @contextmanager
+    def priority(self, level):
+        """
+        Sends made by this thread inside the block use the given PRIORITY_* class.
+        """
+        previous = getattr(self._local, 'priority', PRIORITY_INTERACTIVE)
+        self._local.priority = level
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                # Forget chats whose buckets have refilled; they behave like new ones
+                now = time.monotonic()
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items()
+                                     if value.wait_time(now) > 0 or value.tokens < value.capacity}
+            if chat_id.startswith('-'):
+                bucket = TokenBucket(TELEGRAM_GROUP_RATE, 1)
+            else:
+                bucket = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _admit(self, chat_id):
+        """
+        Blocks until this call may be sent, then takes its tokens.
+        """
+        with self._cond:
+            self._arrivals += 1
+            ticket = (getattr(self._local, 'priority', PRIORITY_INTERACTIVE), self._arrivals, chat_id)
+            self.waiting.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    # The first waiting call (by priority, then arrival) whose chat can take a message goes next
+                    head, chat_wait = None, None
+                    for waiting_ticket in sorted(self.waiting):
+                        wait_for = self._chat_bucket(waiting_ticket[2]).wait_time(now)
+                        if waiting_ticket == ticket:
+                            chat_wait = wait_for
+                        if wait_for == 0:
+                            head = waiting_ticket
+                            break
+                    global_wait = self.global_bucket.wait_time(now)
+                    if head == ticket and global_wait == 0:
+                        self.global_bucket.take()
+                        self._chat_bucket(chat_id).take()
+                        self._cond.notify_all()
+                        return
+                    if head is not None:
+                        timeout = max(global_wait, 0.01)  # Wait for the global bucket, or for the call ahead of us
+                    else:
+                        timeout = chat_wait  # Nothing can go yet; sleep until our chat refills
+                    self._cond.wait(timeout)
+            finally:
+                self.waiting.remove(ticket)
+
+    def request(self, method, url, params=None, files=None, **kwargs):
+        """
+        telebot.apihelper.CUSTOM_REQUEST_SENDER: sends one Bot API request, rate limited.
+        """
+        chat_id = params.get('chat_id') if params else None
+        if chat_id is None:
+            return self.session.request(method, url, params=params, files=files, **kwargs)
+
+        chat_id = str(chat_id)
+        for attempt in range(self.max_retries + 1):
+            self._admit(chat_id)
+            response = self.session.request(method, url, params=params, files=files, **kwargs)
+            if response.status_code != 429 or attempt == self.max_retries:
+                break
+            try:
+                retry_after = int(response.json().get('parameters', {}).get('retry_after', 1))
+            except ValueError:
+                retry_after = 1
+            logging.warning(f"Telegram rate limited chat {chat_id}, retrying in {retry_after}s.")
+            with self._cond:
+                self.throttled += 1
+                self._chat_bucket(chat_id).pause(retry_after)
+            for value in (files or {}).values():
+                # Uploads were consumed by the failed attempt
+                file = value[1] if isinstance(value, tuple) else value
+                if hasattr(file, 'seek'):
+                    file.seek(0)
+        with self._cond:
+            self.sent += 1
+        return response
+
+telegram_dispatcher = TelegramDispatcher()
+telebot.apihelper.CUSTOM_REQUEST_SENDER = telegram_dispatcher.request
+
 # ----------------------------#
 #     Access Restriction      #
 # ----------------------------#
@@ -212,11 +913,13 @@ def broadcast_message(message):
             message_to_broadcast = "Message To All Users By Admin:\n\n" + command[1]
             with open(USER_FILE, "r") as file:
                 user_ids = file.read().splitlines()
+            # Paced by telegram_dispatcher, after any interactive replies that are waiting
+            with telegram_dispatcher.priority(PRIORITY_BROADCAST):
                 for user_id in user_ids:
                     try:
                         bot.send_message(user_id, message_to_broadcast)
                     except Exception as e:
-                        print(f"Failed to send broadcast message to user {user_id}: {str(e)}")
+                        logging.error(f"Failed to send broadcast message to user {user_id}: {str(e)}")
             response = "Broadcast Message Sent Successfully To All Users."
         else:
             response = "Please Provide A Message To Broadcast."
@@ -302,122 +1005,1107 @@ def restricted(func):
 #        Helper Functions     #
 # ----------------------------#
 
-def save_token_to_file(token_data):
+class TokenStore:
+    """
+    The MSAL token cache on disk, safe to share between bot processes.
+
+    The file holds the serialized cache and a change counter. Writes go to a
+    temp file that is renamed over the store, so readers never see a partial
+    file, and every write bumps the counter. Token operations run under an
+    exclusive flock on a side lock file; they first reload the cache only if
+    the counter moved, so a refresh made by one process is picked up by the
+    others instead of being repeated.
+    """
+
+    def __init__(self, path=TOKEN_CACHE_FILE):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.version = None  # Counter of the cache content held in token_cache
+        self._thread_lock = threading.RLock()
+
+    @contextmanager
+    def locked(self):
+        """
+        Holds the store's lock, across threads and (where flock exists) processes.
+        """
+        with self._thread_lock:
+            with open(self.lock_path, "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        """
+        Returns (change counter, serialized cache), or (0, None) if there is no store yet.
+        """
+        if not os.path.exists(self.path):
+            return 0, None
+        with open(self.path, "r") as cache_file:
+            data = json.load(cache_file)
+        if 'cache' in data:
+            return data['version'], data['cache']
+        return 0, json.dumps(data)  # A bare MSAL cache, as written before the counter existed
+
+    def load(self):
+        """
+        Reloads token_cache if the store changed since it was last read or written.
+        Returns True if it did.
+        """
+        try:
+            version, serialized = self._read()
+        except Exception as e:
+            logging.error(f"Error loading token cache: {e}")
+            return False
+        if serialized is None or version == self.version:
+            return False
+        token_cache.deserialize(serialized)
+        token_cache.has_state_changed = False
+        self.version = version
+        logging.info(f"Loaded MSAL token cache (version {version}).")
+        return True
+
+    def save(self):
+        """
+        Writes token_cache if MSAL changed it. Call while holding locked().
+        """
+        if not token_cache.has_state_changed:
+            return
+        temp_file = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            version = self._read()[0] + 1
+            with open(temp_file, "w") as cache_file:
+                json.dump({'version': version, 'cache': token_cache.serialize()}, cache_file)
+                cache_file.flush()
+                os.fsync(cache_file.fileno())
+            os.replace(temp_file, self.path)
+            token_cache.has_state_changed = False
+            self.version = version
+            logging.info(f"Token cache saved successfully (version {version}).")
+        except Exception as e:
+            logging.error(f"Error saving token cache: {e}")
+
+token_store = TokenStore()
+
+def import_legacy_token():
     """
-    Saves token data to a file with an expiry timestamp.
+    Moves a refresh token from the old user_token.txt into the MSAL cache (once).
     """
-    token_data['expires_at'] = (datetime.now() + timedelta(seconds=token_data['expires_in'])).timestamp()
+    if not os.path.exists(TOKEN_FILE):
+        return None
     try:
-        with open(TOKEN_FILE, "w") as token_file:
-            json.dump(token_data, token_file)
-        logging.info("Token saved successfully.")
+        with open(TOKEN_FILE, "r") as token_file:
+            refresh_token = json.load(token_file).get('refresh_token')
+        if not refresh_token:
+            return None
+        result = msal_app.acquire_token_by_refresh_token(refresh_token, scopes=GRAPH_SCOPES)
+        if "access_token" in result:
+            token_store.save()
+            os.replace(TOKEN_FILE, f"{TOKEN_FILE}.migrated")
+            logging.info(f"Imported the token from {TOKEN_FILE} into the MSAL token cache.")
+            return result
+        logging.warning(f"Could not import the token from {TOKEN_FILE}: {result.get('error_description', result.get('error'))}")
     except Exception as e:
-        logging.error(f"Error saving token to file: {e}")
+        logging.error(f"Error importing token from file: {e}")
+    return None
+
+def acquire_token(force_refresh=False):
+    """
+    Gets an access token from MSAL's cache with acquire_token_silent. MSAL only
+    calls the token endpoint when the cached token is (nearly) expired or
+    `force_refresh` is set. Returns token data with expires_at, or None if the
+    user has to authenticate.
+
+    Runs under the token store's lock. If another process renewed the tokens
+    in the meantime, a forced refresh is skipped and its tokens are used.
+    """
+    with token_store.locked():
+        if token_store.load() and force_refresh:
+            logging.info("Token cache was renewed by another process, using its tokens.")
+            force_refresh = False
+        accounts = msal_app.get_accounts()
+        if accounts:
+            result = msal_app.acquire_token_silent(GRAPH_SCOPES, account=accounts[0], force_refresh=force_refresh)
+        else:
+            result = import_legacy_token()
+        token_store.save()
+
+    if result and "access_token" in result:
+        result['expires_at'] = time.time() + int(result.get('expires_in', 0))
+        return result
+    if result:
+        logging.warning(f"Failed to acquire token: {result.get('error_description', result.get('error'))}")
+    return None
+
+class TokenHolder:
+    """
+    Process-wide holder of the Graph token.
+
+    The token comes from MSAL's token cache (see acquire_token) and is then
+    served from memory until its expires_at passes. New tokens from device
+    login are added to the cache by MSAL; the holder just keeps them.
 
-def load_token_from_file():
+    A background thread renews the token TOKEN_REFRESH_MARGIN seconds before it
+    expires, so request threads keep using the current token and never wait on
+    a refresh. All loads and refreshes share one lock: exactly one refresh runs
+    at a time, and callers queued behind it get its result.
     """
-    Loads token data from a file if it's still valid. Attempts to refresh if expired.
+
+    def __init__(self, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self.token_data = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def valid(self, token_data):
+        return bool(token_data) and 'access_token' in token_data and time.time() < token_data.get('expires_at', 0)
+
+    def refresh_due_at(self, token_data):
+        """
+        When the token should be renewed: the margin before expiry, capped at half its lifetime.
+        """
+        margin = min(self.refresh_margin, token_data.get('expires_in', self.refresh_margin * 2) / 2)
+        return token_data['expires_at'] - margin
+
+    def get(self):
+        """
+        Returns the current token data, or None if the user has to authenticate.
+        """
+        token_data = self.token_data
+        if self.valid(token_data):
+            return token_data
+        with self._lock:
+            if not self.valid(self.token_data):  # Another thread may have reloaded it meanwhile
+                self.token_data = acquire_token()
+            return self.token_data
+
+    def set(self, token_data):
+        token_data['expires_at'] = time.time() + int(token_data.get('expires_in', 0))
+        with token_store.locked():
+            token_store.save()
+        with self._lock:
+            self.token_data = token_data
+        self._wake.set()
+
+    def refresh(self):
+        """
+        Renews the token if it is due. Returns the (possibly unchanged) token data.
+        """
+        with self._lock:
+            token_data = self.token_data if self.valid(self.token_data) else acquire_token()
+            if token_data and time.time() >= self.refresh_due_at(token_data):
+                logging.info("Token expires soon. Refreshing it in the background.")
+                token_data = acquire_token(force_refresh=True) or token_data
+            self.token_data = token_data
+            return token_data
+
+    def _run(self):
+        while True:
+            delay = TOKEN_RETRY_INTERVAL
+            try:
+                token_data = self.refresh()
+                if token_data:
+                    due_in = self.refresh_due_at(token_data) - time.time()
+                    if due_in > 0:
+                        delay = due_in
+            except Exception as e:
+                logging.error(f"Exception in token refresher: {e}")
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+            self._thread.start()
+            logging.info("Token refresher started.")
+token_holder = TokenHolder()
+
+class DeviceLogin:
+    """
+    Device code login on a background thread.
+
+    Waiting for someone to enter the code can take up to ~15 minutes, so the
+    flow runs on its own "device-login" thread and handler threads return at
+    once. There is only ever one pending flow: users asking to log in while it
+    runs are added to its waiters and get the same code, and every waiter is
+    told when the login succeeds, fails or expires.
     """
-    if os.path.exists(TOKEN_FILE):
+
+    def __init__(self):
+        self.flow = None
+        self.waiters = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def instructions(flow):
+        return f"Go to {flow['verification_uri']} and enter the code: {flow['user_code']}"
+
+    def _notify(self, user_ids, text):
+        for user_id in user_ids:
+            try:
+                bot.send_message(user_id, text)
+            except Exception as e:
+                logging.error(f"Error notifying user {user_id} about authentication: {e}")
+
+    def request(self, user_id):
+        """
+        Starts a login, or joins the pending one. Never blocks on the login itself.
+        """
+        with self._lock:
+            self.waiters.add(user_id)
+            flow = self.flow
+            start = self._thread is None
+            if start:
+                self._thread = threading.Thread(target=self._run, name="device-login", daemon=True)
+        if start:
+            self._thread.start()
+        elif flow:
+            self._notify([user_id], self.instructions(flow))
+            logging.info(f"User {user_id} joined the pending device login.")
+        # Otherwise the flow is being created and the code is sent to every waiter shortly
+
+    def _finish(self, text):
+        with self._lock:
+            waiters = self.waiters
+            self.flow, self.waiters, self._thread = None, set(), None
+        self._notify(waiters, text)
+        return waiters
+
+    def _run(self):
         try:
-            with open(TOKEN_FILE, "r") as token_file:
-                token_data = json.load(token_file)
-                if datetime.now().timestamp() < token_data['expires_at']:
-                    logging.info("Loaded valid token from file.")
-                    return token_data
-                elif 'refresh_token' in token_data:
-                    # Token expired, use the refresh token to get a new access token
-                    logging.info("Token expired. Attempting to refresh token.")
-                    new_token_response = msal_app.acquire_token_by_refresh_token(
-                        token_data['refresh_token'],
-                        scopes=["Files.ReadWrite.All"]
-                    )
-                    if "access_token" in new_token_response:
-                        save_token_to_file(new_token_response)
-                        logging.info("Token refreshed successfully.")
-                        return new_token_response
-                    else:
-                        logging.warning("Failed to refresh token.")
+            flow = msal_app.initiate_device_flow(scopes=GRAPH_SCOPES)
+
+            if 'user_code' not in flow:
+                logging.error("Failed to create device flow. Check app permissions.")
+                self._finish("Authentication error. Please contact the administrator.")
+                return
+
+            with self._lock:
+                self.flow = flow
+                waiters = set(self.waiters)
+            self._notify(waiters, self.instructions(flow))
+            logging.info(f"Sent authentication message to users {sorted(waiters)}.")
+
+            token_response = msal_app.acquire_token_by_device_flow(flow)  # Blocks until sign-in or expiry
+
+            if "access_token" in token_response:
+                token_holder.set(token_response)
+                waiters = self._finish("You have been successfully authenticated!")
+                logging.info(f"Device login completed; notified users {sorted(waiters)}.")
+            else:
+                waiters = self._finish("Authentication failed or the code expired, please try again.")
+                logging.warning(f"Device login failed for users {sorted(waiters)}: "
+                                f"{token_response.get('error_description', token_response.get('error'))}")
         except Exception as e:
-            logging.error(f"Error loading token from file: {e}")
-    else:
-        logging.info("No token file found.")
-    return None
+            logging.error(f"Exception during device login: {e}")
+            self._finish("An error occurred during authentication. Please try again later.")
+
+device_login = DeviceLogin()
 
 def authenticate_user(user_id):
     """
-    Authenticates the user using Microsoft Graph device code flow.
+    Authenticates the user using Microsoft Graph device code flow (see DeviceLogin).
     """
-    try:
-        # Include the offline_access scope to allow for token refresh
-        flow = msal_app.initiate_device_flow(scopes=["Files.ReadWrite.All"])
+    device_login.request(user_id)
 
-        if 'user_code' not in flow:
-            logging.error("Failed to create device flow. Check app permissions.")
-            bot.send_message(user_id, "Authentication error. Please contact the administrator.")
-            return
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls.
+
+    The first caller for a key runs the call; callers arriving with the same key
+    while it is in flight wait for it and receive the same result (or exception).
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn(*args, **kwargs)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+
+# Shared by every coalesced Graph read
+graph_flights = SingleFlight()
+
+class FolderListing:
+    """
+    Lazily paged children of a OneDrive folder.
 
-        verification_message = f"Go to {flow['verification_uri']} and enter the code: {flow['user_code']}"
-        bot.send_message(user_id, verification_message)
-        logging.info(f"Sent authentication message to user {user_id}.")
+    Holds the items fetched so far and the @odata.nextLink of the next page.
+    Further pages are only requested when a caller iterates or slices past
+    what has already been fetched, so early pages never wait on the rest of
+    a large folder.
 
-        token_response = msal_app.acquire_token_by_device_flow(flow)
+    A page that fails to load keeps its nextLink: the listing stays incomplete,
+    `fetch_failed` is set, and the next access tries that page again.
+    """
 
-        if "access_token" in token_response:
-            save_token_to_file(token_response)
-            bot.send_message(user_id, "You have been successfully authenticated!")
-            logging.info(f"User {user_id} authenticated successfully.")
+    def __init__(self, access_token, items, next_link=None):
+        self.access_token = access_token
+        self.items = list(items)
+        self.next_link = next_link
+        self.fetch_failed = False
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self):
+        return self.next_link is None
+
+    def _fetch_next_page(self):
+        """
+        Fetches the next page. Returns False (keeping next_link) if it could not be fetched.
+        """
+        try:
+            response = graph.get(self.next_link, self.access_token)
+        except Exception as e:
+            logging.error(f"Exception fetching next page of files: {e}")
+            self.fetch_failed = True
+            return False
+        if response.status_code != 200:
+            logging.error(f"Error fetching next page of files: {response.status_code} - {response.text}")
+            self.fetch_failed = True
+            return False
+        data = response.json()
+        self.items.extend(data.get('value', []))
+        self.next_link = data.get('@odata.nextLink')
+        self.fetch_failed = False
+        return True
+
+    def has_at_least(self, count):
+        """
+        Fetches pages until `count` items are available, the folder is exhausted or a page fails.
+        """
+        with self._lock:
+            while len(self.items) < count and self.next_link:
+                if not self._fetch_next_page():
+                    break
+            return len(self.items) >= count
+
+    def fetch_all(self):
+        """
+        Fetches every remaining page. Stops early if a page fails, leaving the listing incomplete.
+        """
+        with self._lock:
+            while self.next_link:
+                if not self._fetch_next_page():
+                    break
+        return self.items
+
+    def __iter__(self):
+        index = 0
+        while self.has_at_least(index + 1):
+            yield self.items[index]
+            index += 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.stop is None or key.stop < 0 or (key.start or 0) < 0:
+                self.fetch_all()
+            else:
+                self.has_at_least(key.stop)
+            return self.items[key]
+        if key < 0:
+            self.fetch_all()
         else:
-            bot.send_message(user_id, "Authentication failed, please try again.")
-            logging.warning(f"Authentication failed for user {user_id}.")
-    except Exception as e:
-        logging.error(f"Exception during authentication for user {user_id}: {e}")
-        bot.send_message(user_id, "An error occurred during authentication. Please try again later.")
+            self.has_at_least(key + 1)
+        return self.items[key]
 
-def get_files(access_token, folder_id=None):
+    def __bool__(self):
+        return self.has_at_least(1)
+
+    def __len__(self):
+        return len(self.fetch_all())
+
+rejected_orderby = set()  # $orderby values Graph refused for this drive; those listings are sorted locally
+
+def get_files(access_token, folder_id=None, select=LISTING_FIELDS, top=GRAPH_PAGE_SIZE, expand=None, orderby=None):
     """
     Fetches files from OneDrive using Microsoft Graph API.
+
+    Concurrent identical listings share one in-flight request (see SingleFlight).
+    """
+    key = ('children', folder_id, select, top, expand, orderby)
+    return graph_flights.do(key, fetch_files, access_token, folder_id, select, top, expand, orderby)
+
+def fetch_files(access_token, folder_id=None, select=LISTING_FIELDS, top=GRAPH_PAGE_SIZE, expand=None, orderby=None):
+    """
+    Lists a folder's children. Called through get_files, which coalesces identical listings.
+
+    Only the first page is requested here; the returned FolderListing follows
+    @odata.nextLink for later pages as the caller consumes them. By default only
+    the LISTING_FIELDS are requested ($select); pass select=None for full driveItems.
+    `expand` (e.g. "permissions") is sent as $expand and `orderby` (e.g. "name")
+    as $orderby. Drives that reject $expand are listed without it; on drives that
+    reject an $orderby the whole folder is listed and sorted here instead.
     """
+    if orderby in rejected_orderby:
+        return fetch_sorted_locally(access_token, folder_id, select, top, expand, orderby)
     try:
         if folder_id:
-            url = f"https://graph.microsoft.com/v1.0/me/drive/items/{folder_id}/children"
+            path = f"me/drive/items/{folder_id}/children"
         else:
-            url = "https://graph.microsoft.com/v1.0/me/drive/root/children"
-
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
+            path = "me/drive/root/children"
+
+        params = {}
+        if select:
+            params['$select'] = select
+        if top:
+            params['$top'] = top
+        if expand:
+            params['$expand'] = expand
+        if orderby:
+            params['$orderby'] = orderby
+
+        response = graph.get(path, access_token, params=params)
+
+        if response.status_code == 400 and expand:
+            logging.warning(f"Graph rejected $expand={expand} on folder listing, listing without it.")
+            return fetch_files(access_token, folder_id, select, top, orderby=orderby)
+        if response.status_code == 400 and orderby:
+            logging.warning(f"Graph rejected $orderby={orderby} on folder listing, sorting folder listings locally.")
+            rejected_orderby.add(orderby)
+            return fetch_sorted_locally(access_token, folder_id, select, top, expand, orderby)
 
         if response.status_code == 200:
             logging.info(f"Fetched files from folder ID: {folder_id if folder_id else 'root'}.")
-            return response.json().get('value', [])
+            data = response.json()
+            return FolderListing(access_token, data.get('value', []), data.get('@odata.nextLink'))
         else:
             logging.error(f"Error fetching files: {response.status_code} - {response.text}")
             return None
     except Exception as e:
-        logging.error(f"Exception in get_files: {e}")
+        logging.error(f"Exception in fetch_files: {e}")
         return None
 
-def find_folder_id_by_name(files, folder_name):
+def fetch_sorted_locally(access_token, folder_id, select, top, expand, orderby):
     """
-    Finds the folder ID by its name from a list of files/folders.
+    Lists a whole folder and sorts it by `orderby` ("field" or "field desc"), for drives without $orderby.
+    """
+    field, _, direction = orderby.partition(' ')
+    if select and field not in select.split(','):
+        select = f"{select},{field}"
+    listing = fetch_files(access_token, folder_id, select, top, expand)
+    if listing is None:
+        return None
+    items = listing.fetch_all()
+    if listing.fetch_failed:
+        logging.error(f"Could not list all of folder {folder_id} to sort it by {orderby}.")
+        return None
+    # Same order as DriveMirror.list_children: by name, then stably by the sort field
+    items = sorted(items, key=lambda item: item.get('name', '').casefold())
+    if field != 'name':
+        items.sort(key=lambda item: (item.get(field) is not None, item.get(field)), reverse=direction == 'desc')
+    elif direction == 'desc':
+        items.reverse()
+    return FolderListing(access_token, items)
+
+class FolderCache:
+    """
+    In-memory folder listings keyed by folder id and sort mode (see SORT_ORDERS).
+
+    A listing is served straight from memory for `ttl` seconds. After that the
+    folder's eTag is revalidated with a conditional GET (If-None-Match): a 304,
+    or an unchanged eTag/cTag, keeps the cached listing (including any pages
+    already fetched) and only a changed folder is listed again. A listing whose
+    later pages failed to load (see FolderListing.fetch_failed) is never served
+    again; the folder is listed afresh instead.
     """
-    for file in files:
-        if file.get('folder', None) and file['name'].lower() == folder_name.lower():
-            logging.info(f"Found folder '{folder_name}' with ID: {file['id']}")
-            return file['id']
-    logging.warning(f"Folder '{folder_name}' not found.")
-    return None
 
-def generate_navigation_buttons(folder_id, page, access_token):
+    def __init__(self, ttl=FOLDER_CACHE_TTL, max_entries=500):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def _fetch_tags(self, access_token, folder_id, etag=None):
+        path = f"me/drive/items/{folder_id}" if folder_id else "me/drive/root"
+        headers = {'If-None-Match': etag} if etag else None
+        response = graph_flights.do(('tags', folder_id, etag), graph.get, path, access_token,
+                                    params={'$select': 'id,eTag,cTag'}, headers=headers)
+        if response.status_code == 304:
+            return 304, etag, None
+        if response.status_code == 200:
+            data = response.json()
+            return 200, data.get('eTag'), data.get('cTag')
+        logging.error(f"Error fetching folder tags: {response.status_code} - {response.text}")
+        return response.status_code, None, None
+
+    def get(self, access_token, folder_id=None, sort='name'):
+        """
+        Returns the cached FolderListing for a folder, revalidating or relisting it as needed.
+        """
+        # Folders inside the mirrored subtree are answered locally
+        if folder_id and drive_mirror.fresh and drive_mirror.in_subtree(folder_id):
+            return drive_mirror.list_children(folder_id, sort)
+
+        key = (folder_id or 'root', sort)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry['listing'].fetch_failed:
+                # A page failed to load: the listing may be missing items whatever the eTag says
+                logging.warning(f"Cached listing of folder {key} is incomplete, listing it again.")
+                self.entries.pop(key, None)
+                entry = None
+
+        if entry and time.monotonic() - entry['checked_at'] < self.ttl:
+            entry['listing'].access_token = access_token
+            return entry['listing']
+
+        try:
+            status, etag, ctag = self._fetch_tags(access_token, folder_id, entry['etag'] if entry else None)
+        except Exception as e:
+            logging.error(f"Exception in FolderCache.get: {e}")
+            status, etag, ctag = None, None, None
+
+        if entry:
+            if status == 304 or (status == 200 and (etag, ctag) == (entry['etag'], entry['ctag'])):
+                logging.info(f"Folder {key} unchanged, serving cached listing.")
+                entry['checked_at'] = time.monotonic()
+                entry['listing'].access_token = access_token
+                return entry['listing']
+            if status != 200 and status != 404:
+                # Graph is unavailable or throttling; a slightly stale listing beats none
+                logging.warning(f"Could not revalidate folder {key}, serving cached listing.")
+                entry['listing'].access_token = access_token
+                return entry['listing']
+
+        if status == 404:
+            self.invalidate(folder_id)
+            return None
+
+        listing = get_files(access_token, folder_id, orderby=SORT_ORDERS[sort])
+        if listing is not None:
+            with self._lock:
+                self.entries.pop(key, None)
+                self.entries[key] = {'listing': listing, 'etag': etag, 'ctag': ctag, 'checked_at': time.monotonic()}
+                while len(self.entries) > self.max_entries:
+                    self.entries.pop(next(iter(self.entries)))  # Evict the oldest listing
+        return listing
+
+    def is_fresh(self, folder_id=None, sort='name'):
+        """
+        True if get() would answer this folder without calling Graph.
+        """
+        if folder_id and drive_mirror.fresh and drive_mirror.in_subtree(folder_id):
+            return True
+        with self._lock:
+            entry = self.entries.get((folder_id or 'root', sort))
+        return (entry is not None and not entry['listing'].fetch_failed
+                and time.monotonic() - entry['checked_at'] < self.ttl)
+
+    def invalidate(self, folder_id=None):
+        with self._lock:
+            for sort in SORT_ORDERS:
+                self.entries.pop((folder_id or 'root', sort), None)
+
+folder_cache = FolderCache()
+
+class BrowseSnapshots:
+    """
+    The listing each user is paging through, pinned when the folder is opened.
+
+    "Next"/"Previous" pages are cut from the pinned FolderListing (which follows
+    the @odata.nextLink cursors of the original query), so pages don't shift when
+    the folder changes mid-browse and paging never lists the folder again.
+    Opening a folder or changing the sort order pins a new snapshot. Snapshots
+    unused for `ttl` seconds are dropped on the next pin, together with the
+    user's sort choice and prefetch generation, so idle users hold no memory.
+    """
+
+    def __init__(self, ttl=SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.snapshots = {}
+        self._lock = threading.Lock()
+
+    def pin(self, user_id, folder_id, sort, listing):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, snapshot in self.snapshots.items()
+                       if key != user_id and now - snapshot['used_at'] > self.ttl]
+            for key in expired:
+                del self.snapshots[key]
+            self.snapshots[user_id] = {'folder_id': folder_id, 'sort': sort, 'listing': listing, 'used_at': now}
+        for key in expired:
+            user_sort_modes.pop(key, None)
+        folder_prefetcher.forget(expired)
+
+    def get(self, user_id, folder_id, sort):
+        """
+        Returns the user's pinned listing of this folder, or None if there is no current one.
+        """
+        with self._lock:
+            snapshot = self.snapshots.get(user_id)
+            if (not snapshot or snapshot['folder_id'] != folder_id or snapshot['sort'] != sort
+                    or time.monotonic() - snapshot['used_at'] > self.ttl):
+                return None
+            snapshot['used_at'] = time.monotonic()
+            return snapshot['listing']
+
+browse_snapshots = BrowseSnapshots()
+user_sort_modes = {}  # user_id -> key of SORT_ORDERS chosen in the file browser
+
+def fold_text(text):
+    """
+    Lowercases text and strips diacritics, so "Épisode" and "episode" compare equal.
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+def tokenize(text):
+    """
+    Splits folded text into word tokens; numbers lose leading zeros ("Episode 07" -> "episode", "7").
+    """
+    return [token.lstrip('0') or '0' if token.isdigit() else token for token in re.findall(r'[^\W_]+', fold_text(text))]
+
+class NameIndex:
+    """
+    Inverted index of item names for /search.
+
+    Names are folded (case and diacritics) and split into word tokens. Each
+    token maps to the ids of the items containing it, and the tokens are kept
+    sorted so a query word matches every token it is a prefix of with a
+    binary search. Items are added and removed one at a time as the drive
+    mirror applies changes.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.tokens = []
+        self.names = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.postings, self.tokens, self.names = {}, [], {}
+
+    def add(self, item_id, name):
+        with self._lock:
+            self._remove(item_id)
+            self.names[item_id] = fold_text(name)
+            for token in set(tokenize(name)):
+                if token not in self.postings:
+                    self.postings[token] = set()
+                    bisect.insort(self.tokens, token)
+                self.postings[token].add(item_id)
+
+    def remove(self, item_id):
+        with self._lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id):
+        name = self.names.pop(item_id, None)
+        if name is None:
+            return
+        for token in set(tokenize(name)):
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            ids.discard(item_id)
+            if not ids:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+    def _prefix_matches(self, word):
+        """
+        Returns {item_id: score} for items with a token starting with `word` (2 for a whole-word match).
+        """
+        matches = {}
+        start = bisect.bisect_left(self.tokens, word)
+        for token in self.tokens[start:]:
+            if not token.startswith(word):
+                break
+            score = 2 if token == word else 1
+            for item_id in self.postings[token]:
+                matches[item_id] = max(matches.get(item_id, 0), score)
+        return matches
+
+    def search(self, query, limit=SEARCH_MAX_RESULTS):
+        """
+        Returns the ids of items matching every word of the query, best first.
+
+        Items score higher for whole-word matches and for names whose tokens start
+        with the query's (compared as tokens, so "episode 7" starts "Episode 0007"
+        but not "Episode 70"); ties go to the shorter name.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+
+        def starts_with_query(name):
+            name_tokens = tokenize(name)
+            if len(name_tokens) < len(words) or name_tokens[:len(words) - 1] != words[:-1]:
+                return False
+            last = name_tokens[len(words) - 1]
+            return last == words[-1] or (not words[-1].isdigit() and last.startswith(words[-1]))
+
+        with self._lock:
+            scores = None
+            for word in words:
+                matches = self._prefix_matches(word)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {item_id: score + matches[item_id] for item_id, score in scores.items() if item_id in matches}
+                if not scores:
+                    return []
+            ranked = sorted(scores.items(), key=lambda entry: (
+                -(entry[1] + (2 if starts_with_query(self.names[entry[0]]) else 0)),
+                len(self.names[entry[0]]),
+                self.names[entry[0]]))
+        return [item_id for item_id, _ in ranked[:limit]]
+
+class DriveMirror:
+    """
+    Local mirror of the home folder subtree, kept current with the OneDrive /delta API.
+
+    OneDrive for Business and SharePoint only support delta on the drive root,
+    so the mirror queries me/drive/root/delta and keeps just the items whose
+    parent chain reaches the home folder. The first sync enumerates the drive;
+    after that only the stored delta link is polled, so each poll returns just
+    what changed. Every kept item is stored as id, name, parent, size, type and
+    eTag, with a parent -> children index so folder listings never touch Graph,
+    and a NameIndex of every name below the root for /search.
+
+    If Graph rejects the delta query itself, the mirror logs it once and
+    disables itself (`failed` holds the reason); callers fall back to Graph.
+    """
+
+    FIELDS = "id,name,parentReference,size,folder,file,eTag,lastModifiedDateTime,deleted"
+
+    def __init__(self, poll_interval=DELTA_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.root_id = None
+        self.items = {}
+        self.children = {}
+        self.delta_link = None
+        self.last_synced = None
+        self.failed = None
+        self.index = NameIndex()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def fresh(self):
+        """
+        True once the initial sync finished and the last successful poll is recent.
+        """
+        return self.last_synced is not None and time.monotonic() - self.last_synced < self.poll_interval * 5
+
+    def sync(self, access_token):
+        """
+        Pulls changes since the last delta link (or the full subtree on the first run).
+        """
+        if not self.root_id:
+            self.root_id = resolve_home_folder_id(access_token)
+            if not self.root_id:
+                return False
+
+        full_sync = self.delta_link is None
+        url = self.delta_link or "me/drive/root/delta"
+        params = None if self.delta_link else {'$select': self.FIELDS}
+        changes = []
+        while url:
+            response = graph.get(url, access_token, params=params)
+            params = None
+            if response.status_code == 410:
+                # Delta token expired (resyncRequired): enumerate the drive again
+                logging.warning("Delta token expired, resyncing drive mirror.")
+                full_sync, changes = True, []
+                url, params = "me/drive/root/delta", {'$select': self.FIELDS}
+                continue
+            if response.status_code in (400, 403, 404, 405, 501):
+                # Delta is not available for this drive: retrying every poll would only repeat the error
+                self.failed = f"{response.status_code} - {response.text}"
+                self._stop.set()
+                logging.error(f"Drive delta is not supported ({self.failed}), drive mirror disabled.")
+                return False
+            if response.status_code != 200:
+                logging.error(f"Error fetching drive delta: {response.status_code} - {response.text}")
+                return False
+            data = response.json()
+            changes.extend(data.get('value', []))
+            url = data.get('@odata.nextLink')
+            if '@odata.deltaLink' in data:
+                self.delta_link = data['@odata.deltaLink']
+
+        self._apply(changes, full_sync)
+        self.last_synced = time.monotonic()
+        logging.info(f"Drive mirror synced {len(changes)} changes ({len(self.items)} items).")
+        return True
+
+    def _apply(self, changes, full_sync):
+        """
+        Applies delta changes for the whole drive, keeping only the root and its descendants.
+
+        `items` only ever holds the subtree, so a change belongs to it when its
+        parent is already kept. Delta does not promise parents before children,
+        so changes whose parent is not known yet are retried until no more can
+        be placed; whatever is left lies outside the subtree.
+        """
+        with self._lock:
+            if full_sync:
+                self.items, self.children = {}, {}
+                self.index.clear()
+            pending = {}
+            for change in changes:
+                item_id = change['id']
+                old = self.items.get(item_id)
+                if 'deleted' in change:
+                    self._drop(item_id)
+                    continue
+                record = {
+                    'id': item_id,
+                    'name': change.get('name', old['name'] if old else ''),
+                    'parent': change.get('parentReference', {}).get('id'),
+                    'size': change.get('size', 0),
+                    'folder': 'folder' in change,
+                    'eTag': change.get('eTag'),
+                    'modified': change.get('lastModifiedDateTime', ''),
+                    'childCount': change.get('folder', {}).get('childCount', 0)
+                }
+                if item_id == self.root_id or record['parent'] in self.items:
+                    self._keep(record, full_sync)
+                else:
+                    # Moved out of the subtree, or its parent comes later in the delta
+                    self._drop(item_id)
+                    pending[item_id] = record
+
+            placed = True
+            while pending and placed:
+                placed = False
+                for item_id, record in list(pending.items()):
+                    if record['parent'] in self.items:
+                        self._keep(record, full_sync)
+                        del pending[item_id]
+                        placed = True
+
+    def _keep(self, record, full_sync):
+        item_id = record['id']
+        old = self.items.get(item_id)
+        if old:
+            self.children.get(old['parent'], set()).discard(item_id)
+        elif not full_sync and record['folder'] and record['childCount']:
+            # A folder moved in from outside the subtree: delta will not list its contents, so enumerate again
+            logging.info(f"Folder '{record['name']}' moved into the mirrored subtree, scheduling a full resync.")
+            self.delta_link = None
+        self.items[item_id] = record
+        self.children.setdefault(record['parent'], set()).add(item_id)
+        if item_id != self.root_id:
+            self.index.add(item_id, record['name'])
+
+    def _drop(self, item_id):
+        """
+        Removes an item and everything below it from the mirror.
+        """
+        stack = [item_id]
+        while stack:
+            current = stack.pop()
+            record = self.items.pop(current, None)
+            if record is None:
+                continue  # Not mirrored (e.g. the root's own parent), so neither is anything below it
+            self.children.get(record['parent'], set()).discard(current)
+            stack.extend(self.children.pop(current, ()))
+            self.index.remove(current)
+
+    def in_subtree(self, item_id):
+        """
+        Checks whether an item is the mirrored root or one of its descendants.
+        """
+        with self._lock:
+            seen = set()
+            while item_id in self.items and item_id not in seen:
+                if item_id == self.root_id:
+                    return True
+                seen.add(item_id)
+                item_id = self.items[item_id]['parent']
+            return False
+
+    def _as_drive_item(self, record):
+        item = {'id': record['id'], 'name': record['name'], 'size': record['size'], 'eTag': record['eTag'],
+                'lastModifiedDateTime': record['modified']}
+        if record['folder']:
+            item['folder'] = {'childCount': len(self.children.get(record['id'], ()))}
+        return item
+
+    def list_children(self, folder_id, sort='name'):
+        """
+        Returns a folder's children as a complete FolderListing, in the order of a SORT_ORDERS mode.
+        """
+        with self._lock:
+            records = sorted((self.items[child_id] for child_id in self.children.get(folder_id, ())),
+                             key=lambda r: r['name'].casefold())
+            if sort == 'date':
+                records.sort(key=lambda r: r['modified'], reverse=True)
+            elif sort == 'size':
+                records.sort(key=lambda r: r['size'], reverse=True)
+            items = [self._as_drive_item(record) for record in records]
+        return FolderListing(None, items)
+
+    def search(self, query, limit=SEARCH_MAX_RESULTS):
+        """
+        Finds items below the root by name. Returns (driveItem, parent name) pairs, best match first.
+        """
+        results = []
+        with self._lock:
+            for item_id in self.index.search(query, limit):
+                record = self.items.get(item_id)
+                if record:
+                    parent = self.items.get(record['parent'])
+                    results.append((self._as_drive_item(record), parent['name'] if parent else ''))
+        return results
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                token_data = token_holder.get()
+                if token_data and 'access_token' in token_data:
+                    self.sync(token_data['access_token'])
+            except Exception as e:
+                logging.error(f"Exception in drive mirror sync: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="drive-mirror", daemon=True)
+            self._thread.start()
+            logging.info(f"Drive mirror started for '{HOME_FOLDER_PATH}'.")
+
+drive_mirror = DriveMirror()
+
+home_folder_id = None  # Cached id of HOME_FOLDER_PATH
+home_folder_lock = threading.Lock()
+
+def resolve_home_folder_id(access_token, refresh=False):
+    """
+    Resolves the "69/USER MARIO" folder id with a single path-addressed Graph call.
+
+    The id is cached for the life of the process; pass refresh=True (or call
+    invalidate_home_folder_id) to resolve it again, e.g. after the folder moved.
+    """
+    global home_folder_id
+    with home_folder_lock:
+        if home_folder_id and not refresh:
+            return home_folder_id
+        try:
+            response = graph.get(f"me/drive/root:/{quote(HOME_FOLDER_PATH)}", access_token, params={'$select': 'id'})
+            if response.status_code == 200:
+                home_folder_id = response.json()['id']
+                logging.info(f"Resolved '{HOME_FOLDER_PATH}' to folder ID: {home_folder_id}")
+                return home_folder_id
+            logging.error(f"Error resolving '{HOME_FOLDER_PATH}': {response.status_code} - {response.text}")
+        except Exception as e:
+            logging.error(f"Exception in resolve_home_folder_id: {e}")
+        return None
+
+def invalidate_home_folder_id():
+    global home_folder_id
+    with home_folder_lock:
+        home_folder_id = None
+
+class FolderPrefetcher:
+    """
+    Speculatively warms folder_cache for the subfolders a user can see.
+
+    After a page of buttons is rendered, the first `max_folders` 📁 entries on it
+    are listed in the background, so the likely next "folder:" tap is answered
+    from memory. Each user has a generation number: rendering a new page bumps it
+    and any queued prefetch from an older page is dropped. Prefetches also give
+    way to user requests and are skipped while Graph is busy or throttling.
+    """
+
+    def __init__(self, enabled=PREFETCH_ENABLED, max_folders=PREFETCH_MAX_FOLDERS, workers=PREFETCH_WORKERS):
+        self.enabled = enabled
+        self.max_folders = max_folders
+        self.generations = {}
+        self.prefetched = 0
+        self.skipped = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+
+    def schedule(self, user_id, access_token, items):
+        """
+        Queues the folders among `items` (driveItems on the rendered page) for prefetching.
+        """
+        with self._lock:
+            generation = self.generations.get(user_id, 0) + 1
+            self.generations[user_id] = generation
+        if not self.enabled:
+            return
+
+        sort = user_sort_modes.get(user_id, 'name')
+        folder_ids = [item['id'] for item in items if item.get('folder')][:self.max_folders]
+        for folder_id in folder_ids:
+            if not folder_cache.is_fresh(folder_id, sort):
+                self._executor.submit(self._prefetch, user_id, generation, access_token, folder_id, sort)
+
+    def forget(self, user_ids):
+        """
+        Drops the generations of users who stopped browsing (see BrowseSnapshots.pin).
+        """
+        with self._lock:
+            for user_id in user_ids:
+                self.generations.pop(user_id, None)
+
+    def _prefetch(self, user_id, generation, access_token, folder_id, sort):
+        try:
+            if self.generations.get(user_id) != generation or folder_cache.is_fresh(folder_id, sort):
+                return  # The user moved on, or the folder was listed meanwhile
+            limiter = graph.limiter
+            if limiter.paused_until > time.monotonic() or limiter.in_flight >= limiter.limit - 1:
+                self.skipped += 1
+                return  # Leave the remaining capacity to user requests
+            if folder_cache.get(access_token, folder_id, sort) is not None:
+                self.prefetched += 1
+        except Exception as e:
+            logging.error(f"Exception prefetching folder {folder_id}: {e}")
+
+folder_prefetcher = FolderPrefetcher()
+
+def generate_navigation_buttons(folder_id, page, access_token, files=None, user_id=None):
     """
     Generates inline keyboard buttons for file navigation.
+
+    When `user_id` is given, pages come from the user's pinned listing snapshot
+    (see BrowseSnapshots) and the subfolders shown on the page are prefetched.
     """
     try:
-        files = get_files(access_token, folder_id)
+        sort = user_sort_modes.get(user_id, 'name')
+        if files is None and user_id is not None:
+            files = browse_snapshots.get(user_id, folder_id, sort)
+            if files is not None:
+                files.access_token = access_token  # Later pages are fetched with the current token, not the one pinned with it
+        if files is None:
+            files = folder_cache.get(access_token, folder_id, sort)
+            if files is not None and user_id is not None:
+                browse_snapshots.pin(user_id, folder_id, sort, files)
         if not files:
             return None
 
@@ -427,7 +2115,8 @@ def generate_navigation_buttons(folder_id, page, access_token):
         start = page * page_size
         end = start + page_size
 
-        for file in files[start:end]:
+        page_files = files[start:end]
+        for file in page_files:
             if file.get('folder', None):
                 markup.add(InlineKeyboardButton(text=f"📁 {file['name']}", callback_data=f"folder:{file['id']}:0"))
             else:
@@ -437,7 +2126,7 @@ def generate_navigation_buttons(folder_id, page, access_token):
         navigation_buttons = []
         if page > 0:
             navigation_buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"navigate:{folder_id}:{page-1}"))
-        if end < len(files):
+        if files.has_at_least(end + 1):
             navigation_buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"navigate:{folder_id}:{page+1}"))
 
         # Create home and all links buttons
@@ -448,6 +2137,15 @@ def generate_navigation_buttons(folder_id, page, access_token):
         if navigation_buttons:
             markup.row(*navigation_buttons)
         markup.row(all_links_button, home_button)
+        markup.row(*[InlineKeyboardButton(f"{'• ' if mode == sort else ''}Sort by {mode}",
+                                          callback_data=f"sort:{folder_id}:{index}")
+                     for index, mode in enumerate(SORT_MODES)])
+        # Pages not fetched yet may hold subfolders; generate_subtree_links reports if there are none
+        if not files.complete or any(file.get('folder', None) for file in files.items):
+            markup.row(InlineKeyboardButton("Links incl. Subfolders 🗂", callback_data=f"subtreelinks:{folder_id}:0"))
+
+        if user_id is not None:
+            folder_prefetcher.schedule(user_id, access_token, page_files)
 
         return markup
     except Exception as e:
@@ -466,77 +2164,493 @@ def parse_callback_data(callback_data):
         logging.warning(f"Invalid callback data format: {callback_data}")
         return None, None, 0
 
+class LinkStore:
+    """
+    Persistent SQLite store of generated share links, keyed by drive item id.
+
+    Each row keeps the file name, the eTag the link was generated for and the
+    final (shortened) URL, so repeat requests for a file are a local lookup.
+
+    The short_links table maps the codes of the built-in shortener to their
+    URLs; app.py serves the /s/<code> redirects from the same file.
+    """
+
+    def __init__(self, path=LINK_DB_FILE):
+        self.path = path
+        self._local = threading.local()  # sqlite3 connections can't be shared between threads
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS links ("
+                "item_id TEXT PRIMARY KEY, etag TEXT, name TEXT, url TEXT NOT NULL, created_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS short_links ("
+                "code TEXT PRIMARY KEY, url TEXT NOT NULL UNIQUE, created_at REAL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, item_id, etag=None):
+        """
+        Returns {'name', 'url'} for a stored link, or None. If an eTag is given it must match.
+        """
+        return self.get_many([item_id], {item_id: etag} if etag else None).get(item_id)
+
+    def get_many(self, item_ids, etags=None):
+        """
+        Looks up many items at once. Returns {item_id: {'name', 'url'}} for the valid hits.
+        """
+        found = {}
+        conn = self._connect()
+        for start in range(0, len(item_ids), 500):  # Stay under SQLite's bound-parameter limit
+            chunk = item_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT item_id, etag, name, url FROM links WHERE item_id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for item_id, etag, name, url in rows:
+                expected = (etags or {}).get(item_id)
+                if expected and etag and expected != etag:
+                    continue  # File changed since the link was stored
+                found[item_id] = {'name': name, 'url': url}
+        return found
+
+    def put_many(self, entries):
+        """
+        Stores (item_id, etag, name, url) tuples.
+        """
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO links (item_id, etag, name, url, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(item_id, etag, name, url, time.time()) for item_id, etag, name, url in entries]
+            )
+
+    def put(self, item_id, url, name=None, etag=None):
+        self.put_many([(item_id, etag, name, url)])
+
+    def short_code(self, url):
+        """
+        Returns the short code for a URL, storing it on first use.
+
+        The code is the first SHORT_CODE_LENGTH base62 characters of the URL's
+        SHA-256, so the same URL always gets the same code; on the (very rare)
+        clash with another URL the code is lengthened by a character.
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT code FROM short_links WHERE url = ?", (url,)).fetchone()
+        if row:
+            return row[0]
+        digest = base62(int.from_bytes(hashlib.sha256(url.encode()).digest(), 'big'))
+        for length in range(SHORT_CODE_LENGTH, len(digest) + 1):
+            code = digest[:length]
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO short_links (code, url, created_at) VALUES (?, ?, ?)",
+                             (code, url, time.time()))
+            row = conn.execute("SELECT url FROM short_links WHERE code = ?", (code,)).fetchone()
+            if row and row[0] == url:
+                return code
+        raise ValueError(f"No free short code for {url}")
+
+link_store = LinkStore()
+
+BASE62_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+def base62(number):
+    digits = []
+    while True:
+        number, remainder = divmod(number, 62)
+        digits.append(BASE62_ALPHABET[remainder])
+        if not number:
+            return ''.join(reversed(digits))
+
+def clean_view_link(link):
+    """
+    Returns the direct-download form of an anonymous view link, or None if it isn't one.
+    """
+    if link and ':v:' in link:
+        return link.split('?')[0] + "?download=1"
+    return None
+
+def find_view_link(permissions):
+    """
+    Finds an existing anonymous view link in a file's permissions.
+    """
+    for permission in permissions:
+        link = clean_view_link(permission.get('link', {}).get('webUrl'))
+        if link:
+            return link
+    return None
+
 def create_share_link(file_id, access_token):
     """
     Creates a shareable link for a specific file.
     """
     try:
-        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}/permissions"
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
+        response = graph.get(f"me/drive/items/{file_id}/permissions", access_token)
 
         if response.status_code == 200:
-            permissions = response.json().get('value', [])
-            for permission in permissions:
-                link = permission.get('link', {}).get('webUrl')
-                if link and ':v:' in link:
-                    clean_link = link.split('?')[0] + "?download=1"
-                    return shorten_url(clean_link)
+            link = find_view_link(response.json().get('value', []))
+            if link:
+                return shorten_url(link)
 
         # If no existing link, create a new one
-        create_link_url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}/createLink"
         body = {
             'type': 'view',
             'scope': 'anonymous'
         }
 
-        create_link_response = requests.post(create_link_url, headers=headers, json=body)
+        create_link_response = graph.post(f"me/drive/items/{file_id}/createLink", access_token, json=body)
 
         if create_link_response.status_code == 201:
-            link = create_link_response.json().get('link', {}).get('webUrl', None)
-            if link and ':v:' in link:
-                clean_link = link.split('?')[0] + "?download=1"
-                return shorten_url(clean_link)
+            link = clean_view_link(create_link_response.json().get('link', {}).get('webUrl', None))
+            if link:
+                return shorten_url(link)
 
     except Exception as e:
         logging.error(f"Exception in create_share_link: {e}")
     return None
 
+def create_share_links(file_ids, access_token, known_permissions=None):
+    """
+    Creates shareable links for many files with Graph $batch.
+
+    Same rules as create_share_link: existing anonymous view links are reused and
+    only files without one get a createLink call. Files whose permissions are
+    already known (e.g. from a listing with $expand=permissions) skip the
+    permissions GET. Returns the shortened links (or None for failures) in the
+    order of file_ids.
+    """
+    links = [None] * len(file_ids)
+    known_permissions = known_permissions or {}
+    try:
+        lookup = []
+        for index, file_id in enumerate(file_ids):
+            if file_id in known_permissions:
+                links[index] = find_view_link(known_permissions[file_id])
+            else:
+                lookup.append(index)
+
+        permission_requests = [{'method': 'GET', 'url': f"me/drive/items/{file_ids[index]}/permissions"} for index in lookup]
+        for index, (status, body) in zip(lookup, graph.batch(permission_requests, access_token)):
+            if status == 200:
+                links[index] = find_view_link(body.get('value', []))
+
+        # If no existing link, create a new one
+        missing = [index for index, link in enumerate(links) if not link]
+        if missing:
+            create_requests = [{'method': 'POST', 'url': f"me/drive/items/{file_ids[index]}/createLink",
+                                'body': {'type': 'view', 'scope': 'anonymous'}} for index in missing]
+            for index, (status, body) in zip(missing, graph.batch(create_requests, access_token)):
+                if status in (200, 201):
+                    links[index] = clean_view_link(body.get('link', {}).get('webUrl'))
+                else:
+                    logging.error(f"Error creating link for file {file_ids[index]}: {status} - {body}")
+
+        return shorten_urls(links)
+    except Exception as e:
+        logging.error(f"Exception in create_share_links: {e}")
+    return links
+
+def stored_share_links(files):
+    """
+    Looks files up in the link store. Returns their links in order (None when
+    missing or stale) and the indexes that still need a link from Graph.
+    """
+    try:
+        stored = link_store.get_many([file['id'] for file in files], {file['id']: file.get('eTag') for file in files})
+    except Exception as e:
+        logging.error(f"Exception reading link store: {e}")
+        stored = {}
+
+    links = [stored[file['id']]['url'] if file['id'] in stored else None for file in files]
+    missing = [index for index, link in enumerate(links) if not link]
+    logging.info(f"Share links: {len(files) - len(missing)} from store, {len(missing)} from Graph.")
+    return links, missing
+
+def save_share_links(files, links, indexes):
+    try:
+        link_store.put_many([(files[index]['id'], files[index].get('eTag'), files[index]['name'], links[index])
+                             for index in indexes if links[index] and not isinstance(links[index], LongLink)])
+    except Exception as e:
+        logging.error(f"Exception saving to link store: {e}")
+
+def get_share_links(files, access_token):
+    """
+    Returns share links for driveItems, in order, using the link store first.
+
+    Only files without a stored link for their current eTag go to Graph; the
+    new links are saved for next time. Permissions expanded inline in the
+    listing are used instead of fetching them again.
+    """
+    links, missing = stored_share_links(files)
+    if missing:
+        known_permissions = {files[index]['id']: files[index]['permissions'] for index in missing
+                             if 'permissions' in files[index]}
+        created = create_share_links([files[index]['id'] for index in missing], access_token, known_permissions)
+        for index, link in zip(missing, created):
+            links[index] = link
+        save_share_links(files, links, missing)
+    return links
+
+async def shorten_urls_async(urls):
+    """
+    Shortens URLs concurrently (None entries are passed through), in order.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(ASYNC_LINK_CONCURRENCY)
+
+    async def shorten(url):
+        if not url:
+            return None
+        async with semaphore:
+            return await loop.run_in_executor(None, shorten_url, url)
+
+    return await asyncio.gather(*(shorten(url) for url in urls))
+
+async def create_share_links_async(file_ids, access_token, known_permissions=None):
+    """
+    Async create_share_links: the same :v: filtering and ?download=1 rewrite, with
+    $batch calls and shortening running concurrently.
+    """
+    links = [None] * len(file_ids)
+    known_permissions = known_permissions or {}
+    try:
+        lookup = []
+        for index, file_id in enumerate(file_ids):
+            if file_id in known_permissions:
+                links[index] = find_view_link(known_permissions[file_id])
+            else:
+                lookup.append(index)
+
+        permission_requests = [{'method': 'GET', 'url': f"me/drive/items/{file_ids[index]}/permissions"} for index in lookup]
+        for index, (status, body) in zip(lookup, await async_graph.batch(permission_requests, access_token)):
+            if status == 200:
+                links[index] = find_view_link(body.get('value', []))
+
+        # If no existing link, create a new one
+        missing = [index for index, link in enumerate(links) if not link]
+        if missing:
+            create_requests = [{'method': 'POST', 'url': f"me/drive/items/{file_ids[index]}/createLink",
+                                'body': {'type': 'view', 'scope': 'anonymous'}} for index in missing]
+            for index, (status, body) in zip(missing, await async_graph.batch(create_requests, access_token)):
+                if status in (200, 201):
+                    links[index] = clean_view_link(body.get('link', {}).get('webUrl'))
+                else:
+                    logging.error(f"Error creating link for file {file_ids[index]}: {status} - {body}")
+
+        return await shorten_urls_async(links)
+    except Exception as e:
+        logging.error(f"Exception in create_share_links_async: {e!r}")
+    return links
+
+async def get_share_links_async(files, access_token):
+    """
+    Async get_share_links. The link store is read and written on the default
+    executor so SQLite never blocks the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    links, missing = await loop.run_in_executor(None, stored_share_links, files)
+    if missing:
+        known_permissions = {files[index]['id']: files[index]['permissions'] for index in missing
+                             if 'permissions' in files[index]}
+        created = await create_share_links_async([files[index]['id'] for index in missing], access_token, known_permissions)
+        for index, link in zip(missing, created):
+            links[index] = link
+        await loop.run_in_executor(None, save_share_links, files, links, missing)
+    return links
+
+class ShortenerService:
+    """
+    URL shortening across several pyshorteners providers (SHORTENER_PROVIDERS).
+
+    Provider clients are created once and send their requests through one
+    pooled keep-alive session (like GraphClient), and every call is bounded by
+    SHORTENER_TIMEOUT. Providers are tried fastest first, by a moving average
+    of their latency; one that fails three times in a row is benched for a
+    minute. If the first provider has not answered after `hedge_after`
+    seconds (or fails), the URL is also sent to the next provider and the
+    first answer wins.
+    """
+
+    def __init__(self, providers=SHORTENER_PROVIDERS, timeout=SHORTENER_TIMEOUT, hedge_after=SHORTENER_HEDGE_AFTER,
+                 workers=SHORTENER_WORKERS):
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(providers) or 1, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.clients = {}
+        factory = pyshorteners.Shortener()
+        for name in providers:
+            try:
+                client = getattr(factory, name)
+            except Exception as e:
+                logging.error(f"Unknown shortener provider '{name}': {e}")
+                continue
+            client.timeout = timeout
+            self._use_session(client)
+            self.clients[name] = client
+        if TINYURL_API_URL and 'tinyurl' in self.clients:
+            self.clients['tinyurl'].api_url = TINYURL_API_URL
+        if ISGD_API_URL and 'isgd' in self.clients:
+            self.clients['isgd'].api_url = ISGD_API_URL
+        self.health = {name: {'latency': hedge_after / 2, 'calls': 0, 'failures': 0, 'benched_until': 0}
+                       for name in self.clients}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shortener")
+        self._batch_executor = ThreadPoolExecutor(max_workers=workers // 2 or 1, thread_name_prefix="shorten-batch")
+        self._lock = threading.Lock()
+
+    def _use_session(self, client):
+        """
+        Replaces a pyshorteners client's module-level requests.get/post with the pooled session.
+        """
+        def get(url, params=None, headers=None):
+            return self.session.get(client.clean_url(url), params=params, headers=headers, timeout=client.timeout,
+                                    verify=client.verify, proxies=client.proxies)
+
+        def post(url, data=None, json=None, params=None, headers=None):
+            return self.session.post(client.clean_url(url), data=data, json=json, params=params, headers=headers,
+                                     timeout=client.timeout, verify=client.verify, proxies=client.proxies)
+
+        client._get, client._post = get, post
+
+    def ranked(self):
+        """
+        Provider names, fastest first; benched providers only if nothing else is left.
+        """
+        now = time.monotonic()
+        with self._lock:
+            names = sorted(self.clients, key=lambda name: self.health[name]['latency'])
+            available = [name for name in names if self.health[name]['benched_until'] <= now]
+        return available or names
+
+    def _record(self, name, elapsed=None):
+        with self._lock:
+            health = self.health[name]
+            health['calls'] += 1
+            if elapsed is None:
+                health['failures'] += 1
+                health['latency'] = min(health['latency'] * 2, self.timeout)
+                if health['failures'] >= 3:
+                    health['benched_until'] = time.monotonic() + 60
+                    logging.warning(f"Shortener {name} failed {health['failures']} times in a row, benched for 60s.")
+            else:
+                health['failures'] = 0
+                health['latency'] = 0.8 * health['latency'] + 0.2 * elapsed
+
+    def _call(self, name, url):
+        started = time.monotonic()
+        try:
+            short = self.clients[name].short(url)
+        except Exception:
+            self._record(name)
+            raise
+        self._record(name, time.monotonic() - started)
+        return short
+
+    def shorten(self, url):
+        """
+        Shortens one URL. Returns None if no provider answered in time.
+        """
+        providers = iter(self.ranked())
+        deadline = time.monotonic() + self.timeout
+        pending = {}
+
+        def launch_next():
+            name = next(providers, None)
+            if name:
+                pending[self._executor.submit(self._call, name, url)] = name
+
+        launch_next()
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(pending, timeout=min(self.hedge_after, remaining), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                if future.exception() is None:
+                    return future.result()
+                logging.warning(f"Shortener {name} failed: {future.exception()}")
+            launch_next()  # Hedge a slow call, or fail over from a failed one
+        logging.error(f"Could not shorten {url} within {self.timeout}s.")
+        return None
+
+    def shorten_many(self, urls):
+        """
+        Shortens URLs concurrently, in order; None entries are passed through.
+        """
+        return list(self._batch_executor.map(lambda url: self.shorten(url) if url else None, urls))
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(health) for name, health in self.health.items()}
+
+shortener = ShortenerService()
+
+class LongLink(str):
+    """
+    A share link that could not be shortened. It is sent to the user as-is but
+    never saved to the link store, so the file is shortened again next time.
+    """
+
 def shorten_url(url):
     """
-    Shortens a URL using TinyURL.
+    Shortens a URL with the built-in shortener when SHORTENER_BASE_URL is set
+    (a local insert, redirects served by app.py), otherwise with the external
+    providers of ShortenerService. Returns the original URL as a LongLink if
+    shortening fails.
     """
+    if SHORTENER_BASE_URL:
+        try:
+            return f"{SHORTENER_BASE_URL.rstrip('/')}/s/{link_store.short_code(url)}"
+        except Exception as e:
+            logging.error(f"Exception in shorten_url: {e}")
+            return LongLink(url)
     try:
-        s = pyshorteners.Shortener()
-        return s.tinyurl.short(url)
+        return shortener.shorten(url) or LongLink(url)
     except Exception as e:
         logging.error(f"Exception in shorten_url: {e}")
-        return url  # Return original URL if shortening fails
+        return LongLink(url)
+
+def shorten_urls(urls):
+    """
+    Shortens many URLs (None entries are passed through), in order.
+    """
+    if SHORTENER_BASE_URL:
+        return [shorten_url(url) if url else None for url in urls]
+    return [LongLink(url) if url and not short else short for url, short in zip(urls, shortener.shorten_many(urls))]
 
 def generate_file_link(file_id, access_token, user_id, username):
     """
     Generates a shareable link for a specific file and sends it to the user.
     """
     try:
-        # Fetch the file metadata (to get the file name)
-        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}"
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
+        # A link generated earlier for this file is still valid
+        stored = link_store.get(file_id)
+        if stored:
+            bot.send_message(user_id, f"File link for {stored['name']}: {stored['url']}")
+            log_file_link(user_id, username, stored['name'])
+            return
 
-        response = requests.get(url, headers=headers)
+        # Fetch the file metadata (to get the file name)
+        response = graph_flights.do(('item', file_id), graph.get, f"me/drive/items/{file_id}", access_token,
+                                    params={'$select': 'id,name,eTag'})
 
         if response.status_code == 200:
             file_metadata = response.json()
             file_name = file_metadata['name']
-            link = create_share_link(file_id, access_token)
+            link = graph_flights.do(('share-link', file_id), create_share_link, file_id, access_token)
 
             if link:
+                if not isinstance(link, LongLink):
+                    link_store.put(file_id, link, name=file_name, etag=file_metadata.get('eTag'))
                 bot.send_message(user_id, f"File link for {file_name}: {link}")
                 log_file_link(user_id, username, file_name)  # Log the file link generation
             else:
@@ -548,35 +2662,245 @@ def generate_file_link(file_id, access_token, user_id, username):
         logging.error(f"Exception in generate_file_link: {e}")
         bot.send_message(user_id, "An error occurred while generating the file link.")
 
+def send_file_links(files, links, user_id, username, title=None):
+    """
+    Sends "name: link" lines to the user in chunks and logs each generated link.
+    A `title` (e.g. the folder path) heads the first chunk.
+    """
+    with telegram_dispatcher.priority(PRIORITY_BULK):
+        lines = []
+        for file, link in zip(files, links):
+            if link:
+                lines.append(f"{file['name']}: {link}")
+                log_file_link(user_id, username, file['name'])  # Log the file link generation
+
+        if lines:
+            # Send links in chunks to avoid exceeding Telegram's message size limits
+            message_chunks = [lines[i:i + 10] for i in range(0, len(lines), 10)]
+            if title:
+                message_chunks[0].insert(0, title)
+            for chunk in message_chunks:
+                bot.send_message(user_id, "\n".join(chunk))
+            logging.info(f"Sent all file links to user {user_id}.")
+        else:
+            bot.send_message(user_id, "No links found or failed to generate links.")
+
 def generate_all_file_links(folder_id, access_token, user_id, username):
     """
     Generates shareable links for all files in a folder and sends them to the user.
     """
+    if async_graph is not None:
+        # Run the whole pipeline on the async Graph loop so this handler thread is freed at once
+        async_graph.submit(generate_all_file_links_async(folder_id, access_token, user_id, username))
+        return
+
     try:
-        files = get_files(access_token, folder_id)
-        if files:
-            links = []
-            for file in files:
-                if not file.get('folder', None):  # Skip folders, only get files
-                    link = create_share_link(file['id'], access_token)
-                    if link:
-                        links.append(f"{file['name']}: {link}")
-                        log_file_link(user_id, username, file['name'])  # Log the file link generation
-
-            if links:
-                # Send links in chunks to avoid exceeding Telegram's message size limits
-                message_chunks = [links[i:i + 10] for i in range(0, len(links), 10)]
-                for chunk in message_chunks:
-                    bot.send_message(user_id, "\n".join(chunk))
-                logging.info(f"Sent all file links to user {user_id}.")
-            else:
-                bot.send_message(user_id, "No links found or failed to generate links.")
+        listing = get_files(access_token, folder_id, select=LINK_FIELDS, expand='permissions')
+        if listing:
+            files = [file for file in listing if not file.get('folder', None)]  # Skip folders, only get files
+            send_file_links(files, get_share_links(files, access_token), user_id, username)
+            if listing.fetch_failed:
+                bot.send_message(user_id, "Part of the folder could not be listed, so some links are missing. Please try again.")
         else:
             bot.send_message(user_id, "No files found in the folder.")
     except Exception as e:
         logging.error(f"Exception in generate_all_file_links: {e}")
         bot.send_message(user_id, "An error occurred while generating all file links.")
 
+async def list_all_files_async(access_token, folder_id, select=LINK_FIELDS, expand=None):
+    """
+    Lists every child of a folder (all pages) with the async client. Returns None on error.
+    """
+    path = f"me/drive/items/{folder_id}/children" if folder_id else "me/drive/root/children"
+    params = {'$select': select, '$top': str(GRAPH_PAGE_SIZE)}
+    if expand:
+        params['$expand'] = expand
+
+    status, body, _ = await async_graph.get(path, access_token, params=params)
+    if status == 400 and expand:
+        logging.warning(f"Graph rejected $expand={expand} on folder listing, listing without it.")
+        return await list_all_files_async(access_token, folder_id, select)
+    if status != 200:
+        logging.error(f"Error fetching files: {status} - {body}")
+        return None
+
+    items = body.get('value', [])
+    next_link = body.get('@odata.nextLink')
+    while next_link:
+        status, body, _ = await async_graph.get(next_link, access_token)
+        if status != 200:
+            logging.error(f"Error fetching next page of files: {status} - {body}")
+            break
+        items.extend(body.get('value', []))
+        next_link = body.get('@odata.nextLink')
+    return items
+
+async def generate_all_file_links_async(folder_id, access_token, user_id, username):
+    """
+    Async generate_all_file_links: lists the folder, creates links concurrently and sends them.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        files = await list_all_files_async(access_token, folder_id, expand='permissions')
+        if files:
+            files = [file for file in files if not file.get('folder', None)]  # Skip folders, only get files
+            links = await get_share_links_async(files, access_token)
+            await loop.run_in_executor(None, send_file_links, files, links, user_id, username)
+        else:
+            await loop.run_in_executor(None, bot.send_message, user_id, "No files found in the folder.")
+    except Exception as e:
+        logging.error(f"Exception in generate_all_file_links_async: {e!r}")
+        await loop.run_in_executor(None, bot.send_message, user_id, "An error occurred while generating all file links.")
+
+class SubtreeHarvest:
+    """
+    Bookkeeping for one recursive "Generate All Links" run: the SUBTREE_* limits
+    and what was harvested, for the summary sent at the end.
+    """
+
+    def __init__(self, max_depth=SUBTREE_MAX_DEPTH, max_folders=SUBTREE_MAX_FOLDERS, max_files=SUBTREE_MAX_FILES):
+        self.max_depth = max_depth
+        self.max_folders = max_folders
+        self.max_files = max_files
+        self.folders = 0
+        self.files = 0
+        self.links = 0
+        self.truncated = False
+
+    def admit_folder(self, depth):
+        """
+        Counts a subfolder in if it is within the depth and folder limits.
+        """
+        if depth > self.max_depth or self.folders >= self.max_folders:
+            self.truncated = True
+            return False
+        self.folders += 1
+        return True
+
+    def admit_files(self, files):
+        """
+        Returns the part of `files` that still fits in the file limit.
+        """
+        room = max(self.max_files - self.files, 0)
+        if len(files) > room:
+            self.truncated = True
+            files = files[:room]
+        self.files += len(files)
+        return files
+
+    def summary(self):
+        text = f"Done: {self.links} links from {self.files} files in {self.folders} folders."
+        if self.folders == 1 and not self.truncated:
+            text += "\nThis folder has no subfolders; \"Generate All Links\" gives the same result."
+        if self.truncated:
+            text += (f"\nStopped at the limits ({self.max_depth} levels, {self.max_folders} folders, "
+                     f"{self.max_files} files); open a subfolder to harvest the rest.")
+        return text
+
+def split_listing(items, path):
+    """
+    Splits a folder's children into its files and its (subfolder id, path) pairs.
+    """
+    files = [item for item in items if not item.get('folder', None)]
+    subfolders = [(item['id'], f"{path}/{item['name']}" if path else item['name'])
+                  for item in items if item.get('folder', None)]
+    return files, subfolders
+
+def generate_subtree_links(folder_id, access_token, user_id, username):
+    """
+    Recursive "Generate All Links": walks the folder's subtree breadth-first and
+    sends the links of each folder as soon as they are ready.
+    """
+    if async_graph is not None:
+        async_graph.submit(generate_subtree_links_async(folder_id, access_token, user_id, username))
+        return
+
+    try:
+        harvest = SubtreeHarvest()
+        harvest.folders = 1
+        pending = deque([(folder_id, '', 0)])
+        bot.send_message(user_id, "Harvesting links from this folder and its subfolders...")
+        while pending:
+            current_id, path, depth = pending.popleft()
+            listing = get_files(access_token, current_id, select=LINK_FIELDS, expand='permissions')
+            if listing is None:
+                continue
+            files, subfolders = split_listing(listing, path)
+            for subfolder_id, subfolder_path in subfolders:
+                if harvest.admit_folder(depth + 1):
+                    pending.append((subfolder_id, subfolder_path, depth + 1))
+            files = harvest.admit_files(files)
+            if files:
+                links = get_share_links(files, access_token)
+                harvest.links += sum(1 for link in links if link)
+                send_file_links(files, links, user_id, username, title=f"📁 {path or 'This folder'}")
+        bot.send_message(user_id, harvest.summary())
+    except Exception as e:
+        logging.error(f"Exception in generate_subtree_links: {e}")
+        bot.send_message(user_id, "An error occurred while generating the subtree links.")
+
+async def generate_subtree_links_async(folder_id, access_token, user_id, username):
+    """
+    Async generate_subtree_links, as a pipeline: SUBTREE_WORKERS listers take
+    folders off a FIFO queue (so the walk is breadth-first) and queue their
+    subfolders and files; link workers turn each folder's files into links and
+    send them while the rest of the tree is still being listed.
+    """
+    loop = asyncio.get_running_loop()
+    harvest = SubtreeHarvest()
+    harvest.folders = 1
+    folders = asyncio.Queue()
+    batches = asyncio.Queue()
+
+    async def lister():
+        while True:
+            current_id, path, depth = await folders.get()
+            try:
+                items = await list_all_files_async(access_token, current_id, expand='permissions')
+                if items is None:
+                    continue
+                files, subfolders = split_listing(items, path)
+                for subfolder_id, subfolder_path in subfolders:
+                    if harvest.admit_folder(depth + 1):
+                        folders.put_nowait((subfolder_id, subfolder_path, depth + 1))
+                files = harvest.admit_files(files)
+                if files:
+                    await batches.put((path, files))
+            except Exception as e:
+                logging.error(f"Exception listing folder {current_id}: {e!r}")
+            finally:
+                folders.task_done()
+
+    async def linker():
+        while True:
+            path, files = await batches.get()
+            try:
+                links = await get_share_links_async(files, access_token)
+                harvest.links += sum(1 for link in links if link)
+                await loop.run_in_executor(None, send_file_links, files, links, user_id, username,
+                                           f"📁 {path or 'This folder'}")
+            except Exception as e:
+                logging.error(f"Exception generating links for folder {path or folder_id}: {e!r}")
+            finally:
+                batches.task_done()
+
+    workers = []
+    try:
+        await loop.run_in_executor(None, bot.send_message, user_id,
+                                   "Harvesting links from this folder and its subfolders...")
+        folders.put_nowait((folder_id, '', 0))
+        workers = [asyncio.create_task(lister()) for _ in range(SUBTREE_WORKERS)]
+        workers += [asyncio.create_task(linker()) for _ in range(SUBTREE_WORKERS)]
+        await folders.join()
+        await batches.join()
+        await loop.run_in_executor(None, bot.send_message, user_id, harvest.summary())
+    except Exception as e:
+        logging.error(f"Exception in generate_subtree_links_async: {e!r}")
+        await loop.run_in_executor(None, bot.send_message, user_id, "An error occurred while generating the subtree links.")
+    finally:
+        for worker in workers:
+            worker.cancel()
+
 def log_file_link(user_id, username, file_name):
     """
     Logs the generation of a file link with timestamp in IST.
@@ -603,6 +2927,46 @@ def list_files_command(message):
     """
     list_files(message, folder_id=None, page=0, edit=False)
 
+@bot.message_handler(commands=['search'])
+def search_command(message):
+    """
+    Handles /search <terms>: finds files and folders under "USER MARIO" by name.
+    """
+    user_id = message.chat.id
+    try:
+        query = message.text.partition(' ')[2].strip()
+        if not query:
+            bot.send_message(user_id, "Usage: /search <words from the file or folder name>")
+            return
+
+        # The index is built by the drive mirror, which only runs when DRIVE_MIRROR_ENABLED is set
+        if not DRIVE_MIRROR_ENABLED:
+            bot.send_message(user_id, "Search is not enabled on this bot.")
+            return
+        if drive_mirror.failed:
+            bot.send_message(user_id, "Search is unavailable: the search index could not be built.")
+            return
+        if drive_mirror.last_synced is None:
+            bot.send_message(user_id, "The search index is still being built, please try again in a moment.")
+            return
+
+        results = drive_mirror.search(query)
+        if not results:
+            bot.send_message(user_id, f"No files or folders match \"{query}\".")
+            return
+
+        markup = InlineKeyboardMarkup()
+        for item, parent_name in results:
+            if item.get('folder', None):
+                markup.add(InlineKeyboardButton(text=f"📁 {item['name']} · {parent_name}", callback_data=f"folder:{item['id']}:0"))
+            else:
+                markup.add(InlineKeyboardButton(text=f"💾 {item['name']} · {parent_name}", callback_data=f"file:{item['id']}:0"))
+        bot.send_message(user_id, f"Results for \"{query}\":", reply_markup=markup)
+        logging.info(f"User {user_id} searched for '{query}': {len(results)} results.")
+    except Exception as e:
+        logging.error(f"Exception in search_command for user {user_id}: {e}")
+        bot.send_message(user_id, "An error occurred while searching.")
+
 @bot.message_handler(commands=['logs'])
 @restricted
 def send_logs(message):
@@ -711,7 +3075,7 @@ def list_files(message, folder_id=None, page=0, edit=False):
     """
     user_id = message.chat.id
     try:
-        token_data = load_token_from_file()
+        token_data = token_holder.get()
 
         if not token_data or 'access_token' not in token_data:
             bot.send_message(user_id, "You need to authenticate first. Initiating device login...")
@@ -721,37 +3085,25 @@ def list_files(message, folder_id=None, page=0, edit=False):
         access_token = token_data['access_token']
 
         if not folder_id:
-            root_files = get_files(access_token)
-            if not root_files:
-                bot.send_message(user_id, "Failed to retrieve root files.")
-                return
-
-            folder_69_id = find_folder_id_by_name(root_files, "69")
-            if not folder_69_id:
-                bot.send_message(user_id, "'69' folder not found.")
-                return
-
-            files_in_69 = get_files(access_token, folder_69_id)
-            if not files_in_69:
-                bot.send_message(user_id, "Failed to retrieve files in '69' folder.")
-                return
-
-            user_mario_folder_id = find_folder_id_by_name(files_in_69, "USER MARIO")
-            if not user_mario_folder_id:
+            folder_id = resolve_home_folder_id(access_token)
+            if not folder_id:
                 bot.send_message(user_id, "'USER MARIO' folder not found.")
                 return
 
-            folder_id = user_mario_folder_id
             user_sessions[user_id] = folder_id  # Update current folder
             logging.info(f"User {user_id} is now in 'USER MARIO' folder.")
         else:
             user_sessions[user_id] = folder_id  # Update current folder
             logging.info(f"User {user_id} navigated to folder ID: {folder_id}")
 
-        files = get_files(access_token, folder_id)
+        sort = user_sort_modes.get(user_id, 'name')
+        files = folder_cache.get(access_token, folder_id, sort)
+        if files is None and folder_id == home_folder_id:
+            invalidate_home_folder_id()  # The folder may have moved; resolve it again next time
 
         if files is not None:
-            markup = generate_navigation_buttons(folder_id, page, access_token)
+            browse_snapshots.pin(user_id, folder_id, sort, files)  # Later pages come from this listing
+            markup = generate_navigation_buttons(folder_id, page, access_token, files=files, user_id=user_id)
 
             if markup is None:
                 bot.send_message(user_id, "No files to display.")
@@ -782,7 +3134,7 @@ def callback_query(call):
     try:
         action, item_id, page = parse_callback_data(call.data)
 
-        token_data = load_token_from_file()
+        token_data = token_holder.get()
 
         if not token_data or 'access_token' not in token_data:
             bot.send_message(user_id, "Authentication is required. Please login using /myfiles.")
@@ -799,12 +3151,21 @@ def callback_query(call):
             generate_file_link(item_id, access_token, user_id, username)
         elif action == "navigate":
             bot.answer_callback_query(call.id, "Navigating...")
-            markup = generate_navigation_buttons(item_id, int(page), access_token)
+            markup = generate_navigation_buttons(item_id, int(page), access_token, user_id=user_id)
             bot.edit_message_reply_markup(chat_id=user_id, message_id=message_id, reply_markup=markup)
         elif action == "getalllinks":
             bot.answer_callback_query(call.id, "Generating all file links...")
             username = call.from_user.username or "unknown_user"
             generate_all_file_links(item_id, access_token, user_id, username)
+        elif action == "subtreelinks":
+            bot.answer_callback_query(call.id, "Generating links for all subfolders...")
+            username = call.from_user.username or "unknown_user"
+            generate_subtree_links(item_id, access_token, user_id, username)
+        elif action == "sort":
+            mode = SORT_MODES[page] if 0 <= page < len(SORT_MODES) else 'name'
+            bot.answer_callback_query(call.id, f"Sorting by {mode}...")
+            user_sort_modes[user_id] = mode
+            list_files(call.message, folder_id=item_id, page=0, edit=True)
         elif action == "home":
             bot.answer_callback_query(call.id, "Processing Home action...")
             handle_home_action(call, user_id, access_token)
@@ -820,24 +3181,7 @@ def handle_home_action(call, user_id, access_token):
         # Retrieve the user's current folder
         current_folder_id = user_sessions.get(user_id)
 
-        # Function to get USER MARIO folder ID
-        def get_user_mario_folder_id(access_token):
-            root_files = get_files(access_token)
-            if not root_files:
-                return None
-
-            folder_69_id = find_folder_id_by_name(root_files, "69")
-            if not folder_69_id:
-                return None
-
-            files_in_69 = get_files(access_token, folder_69_id)
-            if not files_in_69:
-                return None
-
-            user_mario_folder_id = find_folder_id_by_name(files_in_69, "USER MARIO")
-            return user_mario_folder_id
-
-        user_mario_folder_id = get_user_mario_folder_id(access_token)
+        user_mario_folder_id = resolve_home_folder_id(access_token)
 
         if not user_mario_folder_id:
             bot.send_message(user_id, "USER MARIO folder not found.")
@@ -850,7 +3194,7 @@ def handle_home_action(call, user_id, access_token):
             logging.info(f"User {user_id} clicked 'Home' while already in 'USER MARIO' folder.")
         else:
             # Navigate to USER MARIO folder
-            list_files(call.message, folder_id=None, edit=True)
+            list_files(call.message, folder_id=user_mario_folder_id, edit=True)
             logging.info(f"User {user_id} navigated back to 'USER MARIO' folder.")
     except Exception as e:
         logging.error(f"Exception in handle_home_action for user {user_id}: {e}")
@@ -882,6 +3226,31 @@ def send_logs(message):
         bot.send_message(message.chat.id, "Failed to retrieve logs.")
         logging.error(f"Error sending logs: {e}")
 
+# /graphstats command to show Graph call latency
+@bot.message_handler(commands=['graphstats'])
+@restricted
+def send_graph_stats(message):
+    try:
+        stats = graph.stats()
+        if not stats:
+            bot.send_message(message.chat.id, "No Graph calls recorded yet.")
+            return
+
+        lines = [f"{endpoint}: {entry['calls']} calls, avg {entry['avg_ms']:.0f} ms, max {entry['max_ms']:.0f} ms"
+                 for endpoint, entry in sorted(stats.items())]
+        lines.append(f"\nConcurrency limit: {graph.limiter.limit} ({graph.limiter.in_flight} in flight)")
+        if not SHORTENER_BASE_URL:
+            lines.append("Shorteners: " + ", ".join(
+                f"{name} {health['latency'] * 1000:.0f} ms ({health['calls']} calls{', benched' if health['benched_until'] > time.monotonic() else ''})"
+                for name, health in shortener.stats().items()))
+        lines.append(f"Telegram sends: {telegram_dispatcher.sent} ({telegram_dispatcher.throttled} retried after 429)")
+        if folder_prefetcher.enabled:
+            lines.append(f"Prefetched folders: {folder_prefetcher.prefetched} ({folder_prefetcher.skipped} skipped while busy)")
+        bot.send_message(message.chat.id, "Graph call timings:\n\n" + "\n".join(lines))
+    except Exception as e:
+        bot.send_message(message.chat.id, "Failed to collect Graph stats.")
+        logging.error(f"Error sending Graph stats: {e}")
+
 # /debugg command to download logs as a file
 @bot.message_handler(commands=['debugg'])
 @restricted
@@ -898,6 +3267,9 @@ def send_debug_file(message):
 
 if __name__ == "__main__":
     try:
+        token_holder.start()
+        if DRIVE_MIRROR_ENABLED:
+            drive_mirror.start()
         bot.infinity_polling()
     except Exception as e:
         logging.critical(f"Bot polling failed: {e}")
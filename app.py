@@ -1,13 +1,53 @@
-from flask import Flask
+import os
+import re
+import sqlite3
+import threading
+from flask import Flask, abort, redirect
+
+# Share links shortened by the bot (69.py) live in its link store
+LINK_DB_FILE = os.getenv('LINK_DB_FILE', 'links.db')
+SHORT_CODE_PATTERN = re.compile(r'[0-9A-Za-z]{1,43}')
 
 # Create a Flask application
 app = Flask(__name__)
 
+local = threading.local()  # One read-only sqlite3 connection per worker thread
+short_link_cache = {}  # code -> URL; a code never changes its URL once stored
+
+def lookup_short_link(code):
+    """
+    Returns the URL stored for a short code, or None.
+    """
+    url = short_link_cache.get(code)
+    if url:
+        return url
+    try:
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{LINK_DB_FILE}?mode=ro", uri=True, timeout=5)
+            local.conn = conn
+        row = conn.execute("SELECT url FROM short_links WHERE code = ?", (code,)).fetchone()
+    except sqlite3.Error:
+        local.conn = None  # The bot may not have created the store yet
+        return None
+    if row:
+        short_link_cache[code] = row[0]
+        return row[0]
+    return None
+
 # Define a route for the homepage
 @app.route('/')
 def hello_world():
     return 'This bot is made by @sentrien and currently it hosted and live for everyone'
 
+# Redirect the bot's short links
+@app.route('/s/<code>')
+def short_link(code):
+    url = lookup_short_link(code) if SHORT_CODE_PATTERN.fullmatch(code) else None
+    if not url:
+        abort(404)
+    return redirect(url, code=302)
+
 # Run the application
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    app.run()
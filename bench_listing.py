@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import gzip
+import zlib
+import time
+import requests
+
+# Benchmarks a OneDrive folder listing with full driveItems vs. the bot's $select projection.
+# Usage: python bench_listing.py [folder_id] [iterations]
+# Uses GRAPH_ACCESS_TOKEN if set, otherwise the newest unexpired access token in the bot's MSAL token cache.
+
+GRAPH_API_URL = os.getenv('GRAPH_API_URL', 'https://graph.microsoft.com/v1.0').rstrip('/')
+GRAPH_PAGE_SIZE = int(os.getenv('GRAPH_PAGE_SIZE', '200'))
+TOKEN_CACHE_FILE = os.getenv('TOKEN_CACHE_FILE', 'token_cache.json')
+LISTING_FIELDS = "id,name,folder"
+
+session = requests.Session()
+
+def load_access_token():
+    if os.getenv('GRAPH_ACCESS_TOKEN'):
+        return os.getenv('GRAPH_ACCESS_TOKEN')
+    with open(TOKEN_CACHE_FILE, "r") as cache_file:
+        data = json.load(cache_file)
+    # The bot wraps the serialized MSAL cache as {"version", "cache"}; older files hold the bare cache
+    if 'cache' in data:
+        data = json.loads(data['cache'])
+    tokens = [token for token in data.get('AccessToken', {}).values() if int(token.get('expires_on', 0)) > time.time()]
+    if not tokens:
+        sys.exit(f"No unexpired access token in {TOKEN_CACHE_FILE}; start the bot to refresh it or set GRAPH_ACCESS_TOKEN.")
+    return max(tokens, key=lambda token: int(token['expires_on']))['secret']
+
+def decode_body(raw, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(raw)
+    if encoding == 'deflate':
+        return zlib.decompress(raw)
+    return raw
+
+def list_folder(access_token, folder_id, select=None):
+    """
+    Lists every page of a folder and returns (items, wire bytes, decoded bytes, total ms, decode ms).
+    """
+    if folder_id:
+        url = f"{GRAPH_API_URL}/me/drive/items/{folder_id}/children"
+    else:
+        url = f"{GRAPH_API_URL}/me/drive/root/children"
+
+    params = {'$top': GRAPH_PAGE_SIZE}
+    if select:
+        params['$select'] = select
+
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Accept-Encoding': 'gzip, deflate'
+    }
+
+    items, wire_bytes, body_bytes, decode_ms = 0, 0, 0, 0.0
+    start_time = time.perf_counter()
+    while url:
+        response = session.get(url, headers=headers, params=params, stream=True)
+        response.raise_for_status()
+        raw = response.raw.read(decode_content=False)
+        body = decode_body(raw, response.headers.get('Content-Encoding'))
+
+        decode_start = time.perf_counter()
+        data = json.loads(body)
+        decode_ms += (time.perf_counter() - decode_start) * 1000
+
+        wire_bytes += len(raw)
+        body_bytes += len(body)
+        items += len(data.get('value', []))
+        url = data.get('@odata.nextLink')
+        params = None  # nextLink already carries the query
+    total_ms = (time.perf_counter() - start_time) * 1000
+    return items, wire_bytes, body_bytes, total_ms, decode_ms
+
+def run(label, access_token, folder_id, select, iterations):
+    results = [list_folder(access_token, folder_id, select) for _ in range(iterations)]
+    items, wire_bytes, body_bytes = results[0][:3]
+    total_ms = sorted(r[3] for r in results)[len(results) // 2]
+    decode_ms = sorted(r[4] for r in results)[len(results) // 2]
+    print(f"{label:<10} items={items:<6} wire={wire_bytes:>10} B  json={body_bytes:>10} B  "
+          f"median={total_ms:8.1f} ms  decode={decode_ms:7.2f} ms")
+    return body_bytes, total_ms
+
+if __name__ == "__main__":
+    folder_id = sys.argv[1] if len(sys.argv) > 1 else None
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    access_token = load_access_token()
+
+    full_bytes, full_ms = run("full", access_token, folder_id, None, iterations)
+    select_bytes, select_ms = run("$select", access_token, folder_id, LISTING_FIELDS, iterations)
+    print(f"Payload reduced by {100 * (1 - select_bytes / max(full_bytes, 1)):.1f}%, "
+          f"listing time by {100 * (1 - select_ms / max(full_ms, 0.001)):.1f}%")
@@ -2,6 +2,7 @@ import os
 import requests
 import json
 import telebot
+import time
 from msal import PublicClientApplication
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from datetime import datetime, timedelta
@@ -11,6 +12,10 @@ import pytz
 import logging
 from functools import wraps
 from telegraph import Telegraph
+import re
+import threading
+from collections import deque
+from requests.adapters import HTTPAdapter
 
 # ----------------------------#
 #       Configuration         #
@@ -35,6 +40,11 @@ GRAPH_CLIENT_ID = os.getenv('GRAPH_CLIENT_ID')
 GRAPH_TENANT_ID = os.getenv('GRAPH_TENANT_ID')
 TOKEN_FILE = "user_token.txt"  # File to store the access token
 
+# Microsoft Graph HTTP settings
+GRAPH_API_URL = os.getenv('GRAPH_API_URL', 'https://graph.microsoft.com/v1.0')
+GRAPH_POOL_SIZE = int(os.getenv('GRAPH_POOL_SIZE', '20'))  # Keep-alive connections per host
+GRAPH_TIMEOUT = float(os.getenv('GRAPH_TIMEOUT', '30'))  # Seconds per Graph call
+
 # Validate environment variables
 if not TELEGRAM_BOT_TOKEN:
     logging.error("TELEGRAM_BOT_TOKEN is not set in the environment variables.")
@@ -69,6 +79,91 @@ msal_app = PublicClientApplication(
 # In-memory user sessions
 user_sessions = {}
 
+# ----------------------------#
+#        Graph Client         #
+# ----------------------------#
+
+class GraphClient:
+    """
+    Shared Microsoft Graph HTTP client.
+
+    All Graph calls go through one pooled keep-alive session, so consecutive
+    requests reuse an open TLS connection instead of handshaking every time.
+    Every call is timed and kept in a short history for /graphstats.
+    """
+
+    def __init__(self, base_url=GRAPH_API_URL, pool_size=GRAPH_POOL_SIZE, timeout=GRAPH_TIMEOUT, history=500):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+        self.timings = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def url(self, path):
+        """
+        Builds an absolute Graph URL. Absolute URLs (e.g. @odata.nextLink) are used as-is.
+        """
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, access_token, **kwargs):
+        """
+        Sends a Graph request on the pooled session and records its latency.
+        """
+        headers = kwargs.pop('headers', None) or {}
+        headers['Authorization'] = f'Bearer {access_token}'
+        kwargs.setdefault('timeout', self.timeout)
+
+        started = time.perf_counter()
+        response = self.session.request(method, self.url(path), headers=headers, **kwargs)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        self._record(method, path, response.status_code, elapsed_ms)
+        logging.debug(f"Graph {method} {path} -> {response.status_code} in {elapsed_ms:.1f} ms")
+        return response
+
+    def get(self, path, access_token, **kwargs):
+        return self.request('GET', path, access_token, **kwargs)
+
+    def post(self, path, access_token, **kwargs):
+        return self.request('POST', path, access_token, **kwargs)
+
+    def _record(self, method, path, status_code, elapsed_ms):
+        # Collapse item ids and query strings so timings group by endpoint
+        endpoint = path.split('?')[0].replace(self.base_url, '')
+        endpoint = re.sub(r'items/[^/]+', 'items/{id}', endpoint)
+        with self._lock:
+            self.timings.append((method, endpoint, status_code, elapsed_ms))
+
+    def stats(self):
+        """
+        Returns per-endpoint call count and average/max latency (ms) of recent calls.
+        """
+        with self._lock:
+            timings = list(self.timings)
+
+        summary = {}
+        for method, endpoint, _, elapsed_ms in timings:
+            entry = summary.setdefault(f"{method} {endpoint}", {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            entry['calls'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        for entry in summary.values():
+            entry['avg_ms'] = entry['total_ms'] / entry['calls']
+        return summary
+
+# Single Graph client shared by every Graph call
+graph = GraphClient()
+
 # ----------------------------#
 #     Access Restriction      #
 # ----------------------------#
@@ -169,16 +264,11 @@ def get_files(access_token, folder_id=None):
     """
     try:
         if folder_id:
-            url = f"https://graph.microsoft.com/v1.0/me/drive/items/{folder_id}/children"
+            path = f"me/drive/items/{folder_id}/children"
         else:
-            url = "https://graph.microsoft.com/v1.0/me/drive/root/children"
+            path = "me/drive/root/children"
 
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
+        response = graph.get(path, access_token)
 
         if response.status_code == 200:
             logging.info(f"Fetched files from folder ID: {folder_id if folder_id else 'root'}.")
@@ -260,13 +350,7 @@ def create_share_link(file_id, access_token):
     Creates a shareable link for a specific file.
     """
     try:
-        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}/permissions"
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
+        response = graph.get(f"me/drive/items/{file_id}/permissions", access_token)
 
         if response.status_code == 200:
             permissions = response.json().get('value', [])
@@ -277,13 +361,12 @@ def create_share_link(file_id, access_token):
                     return shorten_url(clean_link)
 
         # If no existing link, create a new one
-        create_link_url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}/createLink"
         body = {
             'type': 'view',
             'scope': 'anonymous'
         }
 
-        create_link_response = requests.post(create_link_url, headers=headers, json=body)
+        create_link_response = graph.post(f"me/drive/items/{file_id}/createLink", access_token, json=body)
 
         if create_link_response.status_code == 201:
             link = create_link_response.json().get('link', {}).get('webUrl', None)
@@ -312,13 +395,7 @@ def generate_file_link(file_id, access_token, user_id, username):
     """
     try:
         # Fetch the file metadata (to get the file name)
-        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}"
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
+        response = graph.get(f"me/drive/items/{file_id}", access_token)
 
         if response.status_code == 200:
             file_metadata = response.json()
@@ -671,6 +748,23 @@ def send_logs(message):
         bot.send_message(message.chat.id, "Failed to retrieve logs.")
         logging.error(f"Error sending logs: {e}")
 
+# /graphstats command to show Graph call latency
+@bot.message_handler(commands=['graphstats'])
+@restricted
+def send_graph_stats(message):
+    try:
+        stats = graph.stats()
+        if not stats:
+            bot.send_message(message.chat.id, "No Graph calls recorded yet.")
+            return
+
+        lines = [f"{endpoint}: {entry['calls']} calls, avg {entry['avg_ms']:.0f} ms, max {entry['max_ms']:.0f} ms"
+                 for endpoint, entry in sorted(stats.items())]
+        bot.send_message(message.chat.id, "Graph call timings:\n\n" + "\n".join(lines))
+    except Exception as e:
+        bot.send_message(message.chat.id, "Failed to collect Graph stats.")
+        logging.error(f"Error sending Graph stats: {e}")
+
 # /debugg command to download logs as a file
 @bot.message_handler(commands=['debugg'])
 @restricted
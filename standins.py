@@ -0,0 +1,571 @@
+import json
+import time
+import base64
+import random
+import argparse
+import itertools
+import threading
+from collections import defaultdict
+from flask import Flask, request, jsonify, Response
+
+# Local stand-ins for Microsoft Graph, the Telegram Bot API, TinyURL and Telegraph,
+# so the bot can be exercised and benchmarked with no network access.
+#
+#   python standins.py --folders 5 --files 200 --users 20
+#
+# then start the bot pointed at the stand-ins (the addresses are printed on startup):
+#
+#   GRAPH_API_URL=http://127.0.0.1:8080/v1.0 TELEGRAM_API_URL=http://127.0.0.1:8080 \
+#   TINYURL_API_URL=http://127.0.0.1:8080/api-create.php ISGD_API_URL=http://127.0.0.1:8080/isgd/create.php \
+#   TELEGRAPH_API_URL=http://127.0.0.1:8080/telegraph \
+#   GRAPH_LOGIN_URL=http://127.0.0.1:8080/login python 69.py
+#
+# Simulated users send /myfiles and then keep tapping the buttons the bot sends back.
+# The time from each update to the bot's reply is reported at /stats and on exit.
+
+app = Flask(__name__)
+config = {
+    'latency': 0.0,  # Seconds added to every Graph call
+    'throttle_rate': 0.0,  # Share of Graph calls answered with 429
+    'shortener_latency': 0.0,
+    'shortener_stall_rate': 0.0,  # Share of shortener calls that hang for shortener_stall seconds
+    'shortener_stall': 5.0,
+    'think_time': 0.5,  # Seconds a simulated user waits before the next tap
+    'token_lifetime': 3600,  # expires_in of issued access tokens
+    'login_latency': 0.0,
+    'enforce_bot_limits': False,  # Answer floods with 429 like Telegram does
+    'reject_orderby': False  # Answer $orderby with 400, as some business drives do
+}
+lock = threading.RLock()
+
+# ----------------------------#
+#       Fake Graph drive      #
+# ----------------------------#
+
+items = {}
+children = defaultdict(list)
+permissions = defaultdict(list)
+changes = {}  # item id -> change sequence number, for /delta
+sequence = itertools.count(1)
+item_ids = itertools.count(1)
+graph_calls = defaultdict(int)
+login_calls = defaultdict(int)
+
+def add_item(name, parent_id, is_folder):
+    item_id = f"STUB{next(item_ids):06d}"
+    item = {
+        'id': item_id,
+        'name': name,
+        'eTag': f'"{{{item_id}}},1"',
+        'cTag': f'"c:{{{item_id}}},1"',
+        'size': 0 if is_folder else random.randint(10_000_000, 2_000_000_000),
+        'createdDateTime': '2024-01-01T00:00:00Z',
+        'lastModifiedDateTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - random.randint(0, 10**7))),
+        'webUrl': f"https://onedrive.stub/{item_id}",
+        'createdBy': {'user': {'displayName': 'Stub User', 'id': 'stub-user'}},
+        'lastModifiedBy': {'user': {'displayName': 'Stub User', 'id': 'stub-user'}},
+        'parentReference': {'driveId': 'stubdrive', 'driveType': 'personal', 'id': parent_id},
+        'fileSystemInfo': {'createdDateTime': '2024-01-01T00:00:00Z', 'lastModifiedDateTime': '2024-01-01T00:00:00Z'}
+    }
+    if is_folder:
+        item['folder'] = {'childCount': 0, 'view': {'viewType': 'thumbnails', 'sortBy': 'name', 'sortOrder': 'ascending'}}
+    else:
+        item['file'] = {'mimeType': 'video/mp4', 'hashes': {'sha1Hash': '%040x' % random.getrandbits(160),
+                                                           'quickXorHash': '%028x' % random.getrandbits(112)}}
+        item['thumbnails'] = [{'id': '0', 'small': {'url': f"https://thumbs.stub/{item_id}/s"}}]
+    with lock:
+        items[item_id] = item
+        children[parent_id].append(item_id)
+        touch(item_id)
+        if parent_id in items:
+            items[parent_id]['folder']['childCount'] += 1
+            touch(parent_id, bump=True)
+    return item_id
+
+def touch(item_id, bump=False):
+    item = items[item_id]
+    if bump:
+        version = int(item['eTag'].rsplit(',', 1)[1].strip('"')) + 1
+        item['eTag'] = f'"{{{item_id}}},{version}"'
+        item['cTag'] = f'"c:{{{item_id}}},{version}"'
+    changes[item_id] = next(sequence)
+
+def build_tree(folders, files, depth):
+    items['root'] = {'id': 'root', 'name': 'root', 'eTag': '"{root},1"', 'folder': {'childCount': 0},
+                     'parentReference': {'id': None}}
+    add_item("Documents", 'root', True)
+    folder_69 = add_item("69", 'root', True)
+    home = add_item("USER MARIO", folder_69, True)
+
+    def fill(parent_id, level):
+        for n in range(files):
+            add_item(f"Episode {n + 1:04d} [1080p].mp4", parent_id, False)
+        if level < depth:
+            for n in range(folders):
+                fill(add_item(f"Season {n + 1:02d}", parent_id, True), level + 1)
+
+    fill(home, 1)
+    return home
+
+def project(item):
+    item = dict(item)
+    select = request.args.get('$select')
+    if select:
+        item = {key: value for key, value in item.items() if key in select.split(',')}
+    if request.args.get('$expand') == 'permissions':
+        item['permissions'] = list(permissions[item['id']])
+    return item
+
+def graph_error(status, code, headers=None):
+    return jsonify({'error': {'code': code, 'message': code}}), status, headers or {}
+
+@app.before_request
+def simulate_graph_conditions():
+    if not request.path.startswith('/v1.0/'):
+        return None
+    internal = request.headers.get('X-Stub-Batch') == '1'
+    graph_calls['internal' if internal else 'http'] += 1
+    if internal:
+        return None
+    if config['latency']:
+        time.sleep(config['latency'])
+    if random.random() < config['throttle_rate']:
+        graph_calls['throttled'] += 1
+        return graph_error(429, 'TooManyRequests', {'Retry-After': '1'})
+    return None
+
+@app.get('/v1.0/me/drive/root/children')
+@app.get('/v1.0/me/drive/items/<item_id>/children')
+def list_children(item_id='root'):
+    if item_id not in items:
+        return graph_error(404, 'itemNotFound')
+    top = min(int(request.args.get('$top', 200)), 1000)
+    skip = int(request.args.get('$skiptoken', 0))
+    with lock:
+        kids = [items[child_id] for child_id in children[item_id]]
+
+    orderby = request.args.get('$orderby')
+    if orderby and config['reject_orderby']:
+        return graph_error(400, 'invalidRequest')
+    if orderby:
+        field, _, direction = orderby.partition(' ')
+        kids.sort(key=lambda item: (item.get(field) or '') if field != 'size' else item.get('size', 0),
+                  reverse=direction == 'desc')
+
+    body = {'value': [project(item) for item in kids[skip:skip + top]]}
+    if skip + top < len(kids):
+        query = {key: value for key, value in request.args.items() if key != '$skiptoken'}
+        query['$skiptoken'] = str(skip + top)
+        body['@odata.nextLink'] = request.base_url + '?' + '&'.join(f"{key}={value}" for key, value in query.items())
+    return jsonify(body)
+
+@app.get('/v1.0/me/drive/root')
+@app.get('/v1.0/me/drive/items/<item_id>')
+def get_item(item_id='root'):
+    if item_id not in items:
+        return graph_error(404, 'itemNotFound')
+    item = items[item_id]
+    if request.headers.get('If-None-Match') == item['eTag']:
+        return Response(status=304)
+    return jsonify(project(item))
+
+@app.get('/v1.0/me/drive/root:/<path:item_path>')
+def get_item_by_path(item_path):
+    current = 'root'
+    for part in item_path.rstrip(':').strip('/').split('/'):
+        matches = [child_id for child_id in children[current] if items[child_id]['name'].lower() == part.lower()]
+        if not matches:
+            return graph_error(404, 'itemNotFound')
+        current = matches[0]
+    return get_item(current)
+
+@app.get('/v1.0/me/drive/items/<item_id>/permissions')
+def list_permissions(item_id):
+    if item_id not in items:
+        return graph_error(404, 'itemNotFound')
+    return jsonify({'value': permissions[item_id]})
+
+@app.post('/v1.0/me/drive/items/<item_id>/createLink')
+def create_link(item_id):
+    if item_id not in items:
+        return graph_error(404, 'itemNotFound')
+    with lock:
+        for permission in permissions[item_id]:
+            if ':v:' in permission['link']['webUrl']:
+                return jsonify(permission), 200
+        permission = {'id': f"perm-{item_id}", 'roles': ['read'],
+                      'link': {'type': 'view', 'scope': 'anonymous',
+                               'webUrl': f"https://1drv.ms/v/s!{item_id}:v:/stub?e=Stub"}}
+        permissions[item_id].append(permission)
+    return jsonify(permission), 201
+
+@app.get('/v1.0/me/drive/root/delta', defaults={'item_id': 'root'})
+@app.get('/v1.0/me/drive/items/<item_id>/delta')
+def delta(item_id):
+    token = request.args.get('token')
+    with lock:
+        if token is None:
+            subtree, stack = [], [item_id]
+            while stack:
+                current = stack.pop()
+                subtree.append(current)
+                stack.extend(children[current])
+            changed = subtree
+        else:
+            changed = [changed_id for changed_id, seq in changes.items() if seq > int(token)]
+        latest = max(changes.values(), default=0)
+
+    skip = int(request.args.get('skip', 0))
+    body = {'value': [items[changed_id] for changed_id in changed[skip:skip + 200]]}
+    if skip + 200 < len(changed):
+        body['@odata.nextLink'] = f"{request.base_url}?skip={skip + 200}" + (f"&token={token}" if token else '')
+    else:
+        body['@odata.deltaLink'] = f"{request.base_url}?token={latest}"
+    return jsonify(body)
+
+@app.post('/v1.0/$batch')
+def batch():
+    sub_requests = request.get_json()['requests']
+    if len(sub_requests) > 20:
+        return graph_error(400, 'invalidRequest')
+    client = app.test_client()
+    responses = []
+    for sub_request in sub_requests:
+        if random.random() < config['throttle_rate']:
+            graph_calls['throttled'] += 1
+            responses.append({'id': sub_request['id'], 'status': 429, 'headers': {'Retry-After': '1'},
+                              'body': {'error': {'code': 'TooManyRequests'}}})
+            continue
+        sub_response = client.open('/v1.0' + sub_request['url'], method=sub_request['method'],
+                                   json=sub_request.get('body'), headers={'X-Stub-Batch': '1'})
+        responses.append({'id': sub_request['id'], 'status': sub_response.status_code, 'body': sub_response.get_json()})
+    random.shuffle(responses)  # Graph does not promise response order
+    return jsonify({'responses': responses})
+
+def churn(per_minute):
+    """
+    Adds files to random folders so caches and the delta mirror see changes.
+    """
+    while True:
+        time.sleep(60 / per_minute)
+        with lock:
+            folders = [item_id for item_id, item in items.items() if 'folder' in item and item_id != 'root']
+        add_item(f"New upload {int(time.time())}.mp4", random.choice(folders), False)
+
+# ----------------------------#
+#      Fake Telegram Bot API  #
+# ----------------------------#
+
+updates = []
+update_ids = itertools.count(1)
+message_ids = itertools.count(1000)
+updates_ready = threading.Condition(lock)
+latencies = defaultdict(list)
+bot_calls = defaultdict(int)
+users = {}
+
+def push_update(update):
+    with updates_ready:
+        update['update_id'] = next(update_ids)
+        updates.append(update)
+        updates_ready.notify_all()
+
+def user_payload(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'username': f"user{user_id}"}
+
+def chat_payload(chat_id):
+    return {'id': chat_id, 'type': 'private', 'first_name': f"user{chat_id}"}
+
+def message_payload(chat_id, text=None, reply_markup=None, message_id=None):
+    message = {'message_id': message_id or next(message_ids), 'date': int(time.time()),
+               'chat': chat_payload(chat_id), 'from': {'id': 1, 'is_bot': True, 'first_name': 'bot'}}
+    if text is not None:
+        message['text'] = text
+    if reply_markup:
+        message['reply_markup'] = reply_markup
+    return message
+
+def send_command(user_id, text):
+    user = users[user_id]
+    user['pending'] = ('command', time.perf_counter())
+    push_update({'message': {'message_id': next(message_ids), 'date': int(time.time()), 'chat': chat_payload(user_id),
+                             'from': user_payload(user_id), 'text': text,
+                             'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]}})
+
+def send_callback(user_id, data, message_id):
+    user = users[user_id]
+    user['pending'] = (data.split(':')[0], time.perf_counter())
+    push_update({'callback_query': {'id': str(next(message_ids)), 'from': user_payload(user_id),
+                                    'chat_instance': str(user_id), 'data': data,
+                                    'message': message_payload(user_id, "Your files are listed below:",
+                                                               message_id=message_id)}})
+
+def next_action(user_id):
+    """
+    Taps a random button from the last keyboard the bot sent this user.
+    """
+    user = users[user_id]
+    buttons = [button for row in (user['markup'] or {}).get('inline_keyboard', []) for button in row]
+    if not buttons or random.random() < 0.05:
+        send_command(user_id, '/myfiles')
+        return
+    weights = {'folder': 5, 'navigate': 4, 'file': 3, 'home': 1, 'getalllinks': 0.3}
+    weighted = [(button, weights.get(button['callback_data'].split(':')[0], 1)) for button in buttons]
+    button = random.choices([b for b, _ in weighted], [w for _, w in weighted])[0]
+    send_callback(user_id, button['callback_data'], user['message_id'])
+
+flood_buckets = {}  # chat id (or 'global') -> [tokens, last refill]
+
+def flooded(chat_id):
+    """
+    Telegram-like flood control: about 1 message/s per chat (bursts of 3) and 30/s in total.
+    """
+    now = time.monotonic()
+    with lock:
+        for key, rate, burst in ((chat_id, 1, 3), ('global', 30, 30)):
+            tokens, updated = flood_buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                flood_buckets[key] = [tokens, now]
+                return 1 + int((1 - tokens) / rate)
+            flood_buckets[key] = [tokens, now]
+        for key in (chat_id, 'global'):
+            flood_buckets[key][0] -= 1
+    return 0
+
+def record_reply(chat_id, reply_markup=None, message_id=None):
+    with lock:
+        user = users.get(int(chat_id))
+        if not user:
+            return
+        if reply_markup:
+            user['markup'] = json.loads(reply_markup) if isinstance(reply_markup, str) else reply_markup
+            user['message_id'] = message_id
+        if user['pending']:
+            action, started = user['pending']
+            user['pending'] = None
+            latencies[action].append((time.perf_counter() - started) * 1000)
+            threading.Timer(config['think_time'] * random.uniform(0.5, 1.5), next_action, (int(chat_id),)).start()
+
+@app.route('/bot<token>/<method>', methods=['GET', 'POST'])
+def bot_api(token, method):
+    params = request.values
+    bot_calls[method] += 1
+    if method == 'getUpdates':
+        offset = int(params.get('offset', 0) or 0)
+        deadline = time.monotonic() + min(float(params.get('timeout', 0) or 0), 10)
+        with updates_ready:
+            while True:
+                pending = [update for update in updates if update['update_id'] >= offset]
+                remaining = deadline - time.monotonic()
+                if pending or remaining <= 0:
+                    break
+                updates_ready.wait(remaining)
+            del updates[:len(updates) - len(pending)]
+        return jsonify({'ok': True, 'result': pending})
+    if method == 'getMe':
+        return jsonify({'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'stub_bot'}})
+    if config['enforce_bot_limits'] and 'chat_id' in params:
+        retry_after = flooded(str(params['chat_id']))
+        if retry_after:
+            bot_calls['429'] += 1
+            return jsonify({'ok': False, 'error_code': 429, 'description': f"Too Many Requests: retry after {retry_after}",
+                            'parameters': {'retry_after': retry_after}}), 429
+    if method in ('sendMessage', 'sendDocument', 'copyMessage', 'forwardMessage'):
+        message = message_payload(int(params['chat_id']), params.get('text', ''), params.get('reply_markup'))
+        record_reply(params['chat_id'], params.get('reply_markup'), message['message_id'])
+        return jsonify({'ok': True, 'result': message if method != 'copyMessage' else {'message_id': message['message_id']}})
+    if method in ('editMessageText', 'editMessageReplyMarkup'):
+        message_id = int(params.get('message_id', 0))
+        record_reply(params['chat_id'], params.get('reply_markup'), message_id)
+        return jsonify({'ok': True, 'result': message_payload(int(params['chat_id']), params.get('text', ''),
+                                                              params.get('reply_markup'), message_id)})
+    return jsonify({'ok': True, 'result': True})
+
+# ----------------------------#
+#   Fake shortener, Telegraph #
+# ----------------------------#
+
+short_links = {}
+shortener_calls = defaultdict(int)
+
+def fake_shorten(provider):
+    shortener_calls[provider] += 1
+    if random.random() < config['shortener_stall_rate']:
+        time.sleep(config['shortener_stall'])
+    elif config['shortener_latency']:
+        time.sleep(config['shortener_latency'])
+    with lock:
+        code = format(len(short_links) + 1, 'x')
+        short_links[code] = request.args['url']
+    return f"{request.host_url}t/{code}"
+
+@app.get('/api-create.php')
+def tinyurl_create():
+    return fake_shorten('tinyurl')
+
+@app.get('/isgd/create.php')
+def isgd_create():
+    return fake_shorten('isgd')
+
+@app.get('/t/<code>')
+def tinyurl_redirect(code):
+    return Response(status=301, headers={'Location': short_links.get(code, '/')})
+
+@app.post('/telegraph/<method>/')
+@app.post('/telegraph/<method>')
+def telegraph_api(method):
+    if method == 'createAccount':
+        return jsonify({'ok': True, 'result': {'short_name': request.values.get('short_name', 'stub'),
+                                               'access_token': 'stub-telegraph-token'}})
+    if method == 'createPage':
+        return jsonify({'ok': True, 'result': {'path': f"Stub-Page-{next(message_ids)}",
+                                               'url': 'https://telegra.ph/Stub-Page'}})
+    return jsonify({'ok': True, 'result': {}})
+
+# ----------------------------#
+#     Fake Microsoft login    #
+# ----------------------------#
+
+def fake_jwt(claims):
+    encode = lambda data: base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode(claims)}."
+
+def token_response(tenant):
+    now = int(time.time())
+    client_info = base64.urlsafe_b64encode(json.dumps({'uid': 'stub-user', 'utid': tenant}).encode()).decode()
+    return {
+        'token_type': 'Bearer',
+        'scope': 'Files.ReadWrite.All openid profile offline_access',
+        'expires_in': config['token_lifetime'],
+        'ext_expires_in': config['token_lifetime'],
+        'access_token': f"stub-access-{now}-{random.getrandbits(32):08x}",
+        'refresh_token': f"stub-refresh-{now}",
+        'client_info': client_info,
+        'id_token': fake_jwt({'iss': f"https://login.microsoftonline.com/{tenant}/v2.0", 'aud': 'stub-client',
+                              'sub': 'stub-user', 'oid': 'stub-user', 'tid': tenant, 'iat': now,
+                              'exp': now + 3600, 'preferred_username': 'user@stub.onmicrosoft.com', 'name': 'Stub User'})
+    }
+
+@app.get('/login/<tenant>/v2.0/.well-known/openid-configuration')
+def openid_configuration(tenant):
+    base = f"https://login.microsoftonline.com/{tenant}"
+    return jsonify({'issuer': f"{base}/v2.0", 'authorization_endpoint': f"{base}/oauth2/v2.0/authorize",
+                    'token_endpoint': f"{base}/oauth2/v2.0/token",
+                    'device_authorization_endpoint': f"{base}/oauth2/v2.0/devicecode"})
+
+@app.get('/login/common/discovery/instance')
+def instance_discovery():
+    return jsonify({'tenant_discovery_endpoint': request.args.get('authorization_endpoint', ''), 'metadata': []})
+
+@app.post('/login/<tenant>/oauth2/v2.0/devicecode')
+def device_code(tenant):
+    return jsonify({'device_code': f"stub-device-{random.getrandbits(32):08x}", 'user_code': 'STUBCODE',
+                    'verification_uri': 'https://microsoft.com/devicelogin', 'expires_in': 900, 'interval': 1,
+                    'message': 'To sign in, enter the code STUBCODE at https://microsoft.com/devicelogin'})
+
+@app.post('/login/<tenant>/oauth2/v2.0/token')
+def token(tenant):
+    login_calls[request.form.get('grant_type', 'unknown')] += 1
+    if config['login_latency']:
+        time.sleep(config['login_latency'])
+    return jsonify(token_response(tenant))
+
+# ----------------------------#
+#          Reporting          #
+# ----------------------------#
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def summary():
+    with lock:
+        actions = {action: list(values) for action, values in latencies.items()}
+    return {
+        'replies': {action: {'count': len(values), 'p50_ms': round(percentile(values, 0.5), 1),
+                             'p95_ms': round(percentile(values, 0.95), 1), 'max_ms': round(max(values), 1)}
+                    for action, values in actions.items() if values},
+        'graph_calls': dict(graph_calls),
+        'bot_calls': dict(bot_calls),
+        'shortener_calls': dict(shortener_calls),
+        'login_calls': dict(login_calls),
+        'drive_items': len(items)
+    }
+
+@app.get('/stats')
+def stats():
+    return jsonify(summary())
+
+def watchdog():
+    """
+    Restarts simulated users whose last action never got a reply.
+    """
+    while True:
+        time.sleep(5)
+        with lock:
+            stalled = [user_id for user_id, user in users.items()
+                       if user['pending'] and time.perf_counter() - user['pending'][1] > 60]
+            for user_id in stalled:
+                latencies['timeout'].append(60_000)
+        for user_id in stalled:
+            send_command(user_id, '/myfiles')
+
+def report(interval):
+    while True:
+        time.sleep(interval)
+        print(json.dumps(summary(), indent=2), flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-ins for Graph, Telegram, TinyURL and Telegraph.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--folders', type=int, default=5, help="Subfolders per folder")
+    parser.add_argument('--files', type=int, default=200, help="Files per folder")
+    parser.add_argument('--depth', type=int, default=2, help="Folder levels below USER MARIO")
+    parser.add_argument('--latency-ms', type=float, default=50, help="Added to every Graph call")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of Graph calls answered with 429")
+    parser.add_argument('--shortener-latency-ms', type=float, default=150)
+    parser.add_argument('--shortener-stall-rate', type=float, default=0.0,
+                        help="share of shortener calls that hang for 5s")
+    parser.add_argument('--churn-per-min', type=float, default=0, help="Files added per minute")
+    parser.add_argument('--users', type=int, default=10, help="Simulated Telegram users")
+    parser.add_argument('--think-ms', type=float, default=500, help="Pause between a reply and the next tap")
+    parser.add_argument('--report-every', type=float, default=30, help="Seconds between printed summaries")
+    parser.add_argument('--enforce-bot-limits', action='store_true', help="Answer Telegram floods with 429")
+    parser.add_argument('--reject-orderby', action='store_true', help="Answer $orderby listings with 400")
+    parser.add_argument('--token-lifetime', type=int, default=3600, help="expires_in of issued tokens (seconds)")
+    parser.add_argument('--login-latency-ms', type=float, default=300)
+    parser.add_argument('--token-file', default="user_token.txt", help="Where to write a stand-in Graph token")
+    args = parser.parse_args()
+
+    config.update(latency=args.latency_ms / 1000, throttle_rate=args.throttle_rate,
+                  shortener_latency=args.shortener_latency_ms / 1000, think_time=args.think_ms / 1000,
+                  shortener_stall_rate=args.shortener_stall_rate, enforce_bot_limits=args.enforce_bot_limits,
+                  reject_orderby=args.reject_orderby,
+                  token_lifetime=args.token_lifetime, login_latency=args.login_latency_ms / 1000)
+    build_tree(args.folders, args.files, args.depth)
+
+    if args.token_file:
+        with open(args.token_file, "w") as token_file:
+            json.dump({'access_token': 'stub-access-token', 'refresh_token': 'stub-refresh-token',
+                       'expires_in': args.token_lifetime, 'expires_at': time.time() + args.token_lifetime}, token_file)
+
+    if args.churn_per_min:
+        threading.Thread(target=churn, args=(args.churn_per_min,), daemon=True).start()
+    threading.Thread(target=report, args=(args.report_every,), daemon=True).start()
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    for user_id in range(100001, 100001 + args.users):
+        users[user_id] = {'markup': None, 'message_id': None, 'pending': None}
+        threading.Timer(random.uniform(0, 2), send_command, (user_id, '/myfiles')).start()
+
+    base = f"http://127.0.0.1:{args.port}"
+    print(f"Stand-ins serving {len(items)} drive items on {base}")
+    print(f"  GRAPH_API_URL={base}/v1.0 TELEGRAM_API_URL={base} "
+          f"TINYURL_API_URL={base}/api-create.php ISGD_API_URL={base}/isgd/create.php "
+          f"TELEGRAPH_API_URL={base}/telegraph GRAPH_LOGIN_URL={base}/login",
+          flush=True)
+    try:
+        app.run(host='127.0.0.1', port=args.port, threaded=True)
+    finally:
+        print(json.dumps(summary(), indent=2))